@@ -0,0 +1,3 @@
+"""
+Offline benchmarks of the bot's hot paths, run with `python -m benchmarks.<name>` from the repository root.
+"""
@@ -0,0 +1,161 @@
+"""
+Building blocks shared by the benchmarks: timing, JSON reports and stand-ins for Discord objects.
+"""
+
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import aiosqlite
+
+from database import DatabaseManager
+from database.migrations import migrate
+
+SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "database", "schema.sql"
+)
+
+
+async def open_database(path: str) -> DatabaseManager:
+    """
+    Creates or opens a database file the same way `DiscordBot.setup_hook` does.
+
+    :param path: The path of the SQLite file.
+    """
+    connection = await aiosqlite.connect(path)
+    await migrate(connection)
+    with open(SCHEMA_PATH) as file:
+        await connection.executescript(file.read())
+    await connection.commit()
+    await connection.execute("PRAGMA journal_mode=WAL")
+    await connection.execute("PRAGMA synchronous=NORMAL")
+    return DatabaseManager(connection=connection)
+
+
+def percentiles(samples: list[float]) -> dict:
+    """
+    Summarises latency samples, in seconds.
+    """
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "min": ordered[0],
+        "p50": at(0.5),
+        "p90": at(0.9),
+        "p99": at(0.99),
+        "max": ordered[-1],
+        "mean": statistics.fmean(ordered),
+    }
+
+
+class Timer:
+    """
+    Measures the wall-clock time of a `with` block.
+    """
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.seconds = time.perf_counter() - self.start
+
+
+def throughput(seconds: float, count: int, unit: str = "rows") -> dict:
+    """
+    A result made of a duration and the number of items processed in it.
+    """
+    return {
+        "seconds": seconds,
+        unit: count,
+        f"{unit}_per_second": count / seconds if seconds > 0 else None,
+    }
+
+
+def report(benchmark: str, parameters: dict, results: dict, output: str | None) -> None:
+    """
+    Writes the results as JSON, to `output` or to standard output.
+
+    :param benchmark: The name of the benchmark.
+    :param parameters: What the benchmark was run with.
+    :param results: The measurements.
+    :param output: The file the report is written to, `None` for standard output.
+    """
+    document = {
+        "benchmark": benchmark,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sqlite": sqlite3.sqlite_version,
+            "cpus": os.cpu_count(),
+        },
+        "parameters": parameters,
+        "results": results,
+    }
+    text = json.dumps(document, indent=2)
+    if output:
+        with open(output, "w") as file:
+            file.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, *, filesize_limit: int = 25 * 1024 * 1024) -> None:
+        """
+        Stands in for a `discord.Guild` whose member and channel caches are empty.
+        """
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.filesize_limit = filesize_limit
+
+    def get_member(self, user_id: int) -> None:
+        return None
+
+    def get_channel(self, channel_id: int) -> None:
+        return None
+
+
+class FakeMessage:
+    def __init__(self, sent: dict) -> None:
+        """
+        Stands in for a `discord.Message` the bot sent, edits replace what is kept in `sent`.
+        """
+        self.sent = sent
+        self.edits = 0
+
+    async def edit(self, **kwargs) -> "FakeMessage":
+        self.edits += 1
+        self.sent.update(kwargs)
+        return self
+
+
+class FakeContext:
+    def __init__(self, guild: FakeGuild) -> None:
+        """
+        Stands in for a `commands.Context`, everything the command sends is kept in `sent`.
+        """
+        self.guild = guild
+        self.sent: list[dict] = []
+
+    async def send(self, content: str | None = None, **kwargs) -> FakeMessage:
+        file = kwargs.get("file")
+        if file is not None:
+            # Reading the attachment is part of what sending it would cost.
+            file.fp.read()
+        sent = {"content": content, **kwargs}
+        self.sent.append(sent)
+        return FakeMessage(sent)
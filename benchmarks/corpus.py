@@ -0,0 +1,115 @@
+"""
+A synthetic, reproducible message corpus that looks like real Discord chat to the database.
+
+Authors follow a power law (a few users write most messages), words follow Zipf's law and message
+lengths are log-normal, so indexes, rollups and the tokenizer see realistic skew.
+"""
+
+import itertools
+import math
+import random
+import time
+
+# Discord snowflakes count milliseconds since 2015-01-01.
+DISCORD_EPOCH = 1420070400000
+
+_SYLLABLES = ("ka", "lo", "mi", "re", "ta", "shi", "no", "ve", "ru", "pa", "de", "qu", "zo", "en", "th")
+
+
+def snowflake(timestamp: float, sequence: int) -> int:
+    """
+    A message ID for a UNIX timestamp, unique for every sequence number below 4096.
+    """
+    return (int(timestamp * 1000) - DISCORD_EPOCH) << 22 | (sequence & 0xFFF)
+
+
+class Corpus:
+    def __init__(
+        self,
+        *,
+        guilds: int = 2,
+        channels: int = 8,
+        users: int = 200,
+        messages: int = 50000,
+        days: int = 30,
+        vocabulary: int = 5000,
+        seed: int = 0,
+        end: int | None = None,
+    ) -> None:
+        """
+        Describes a corpus, the messages are generated lazily by `rows`.
+
+        :param guilds: The number of guilds.
+        :param channels: The number of channels per guild.
+        :param users: The number of users, shared between the guilds.
+        :param messages: The total number of messages.
+        :param days: The number of days, ending now, the messages are spread over.
+        :param vocabulary: The number of distinct words.
+        :param seed: Makes the corpus reproducible.
+        :param end: The UNIX timestamp of the newest message, defaults to now so that the last day
+            is still in progress, as it is for the bot.
+        """
+        self.guilds = guilds
+        self.channels = channels
+        self.users = users
+        self.messages = messages
+        self.days = days
+        self.seed = seed
+
+        generator = random.Random(seed)
+        self.guild_ids = [100000 + i for i in range(guilds)]
+        self.channel_ids = {
+            guild_id: [guild_id * 1000 + i for i in range(channels)] for guild_id in self.guild_ids
+        }
+        self.user_ids = [200000 + i for i in range(users)]
+        self.words = sorted(
+            {
+                "".join(generator.choice(_SYLLABLES) for _ in range(generator.randint(1, 4)))
+                for _ in range(vocabulary * 2)
+            }
+        )[:vocabulary]
+        generator.shuffle(self.words)
+        # Cumulative weights keep `random.choices` from summing them again on every call.
+        self._word_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(self.words))))
+        self._user_weights = list(itertools.accumulate(1 / (rank + 1) ** 1.1 for rank in range(users)))
+        self.end = end if end is not None else int(time.time())
+        self.start = self.end - days * 24 * 60 * 60
+
+    def parameters(self) -> dict:
+        """
+        The parameters of the corpus, for the benchmark report.
+        """
+        return {
+            "guilds": self.guilds,
+            "channels": self.channels,
+            "users": self.users,
+            "messages": self.messages,
+            "days": self.days,
+            "vocabulary": len(self.words),
+            "seed": self.seed,
+        }
+
+    def rows(self):
+        """
+        Generates the messages, oldest first, as the rows `DatabaseManager.add_msgs` takes.
+
+        :return: An iterator of `(message_id, channel_id, server_id, user_id, message, created_at)`.
+        """
+        generator = random.Random(self.seed + 1)
+        step = (self.end - self.start) / max(1, self.messages)
+        for i in range(self.messages):
+            created_at = self.start + i * step
+            guild_id = self.guild_ids[i % len(self.guild_ids)]
+            channel_id = generator.choice(self.channel_ids[guild_id])
+            user_id = generator.choices(self.user_ids, cum_weights=self._user_weights)[0]
+            # Median around 8 words, with a long tail of paragraphs.
+            length = max(1, min(300, int(math.exp(generator.gauss(2.1, 0.9)))))
+            message = " ".join(generator.choices(self.words, cum_weights=self._word_weights, k=length))
+            yield (
+                snowflake(created_at, i),
+                channel_id,
+                guild_id,
+                user_id,
+                message,
+                int(created_at),
+            )
@@ -0,0 +1,200 @@
+"""
+Load-tests the LLM commands against a local stub of Ollama, see `benchmarks.ollama_stub`.
+
+    python -m benchmarks.llm --requests 32 --concurrency 8 --latency 0.2 --tokens-per-second 40
+
+Runs `OllamaLanguageModel.reduce_text` on slices of a synthetic corpus, then `!query` end to end
+against a database holding the same corpus. Every request asks something different, so the response
+cache only helps where the real bot would be helped by it too. Reports requests per second, the
+number of model calls each request took and the latency of requests and of single calls.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks.common import FakeContext, FakeGuild, Timer, open_database, percentiles, report
+from benchmarks.corpus import Corpus
+from benchmarks.ollama_stub import add_arguments, from_arguments
+from benchmarks.storage import make_bot, make_flags
+from helpers.converters import HistoryFlags
+
+
+def time_calls(model, samples: list[float]) -> None:
+    """
+    Records the duration of every `sample_text` call of `model`, queueing included, in `samples`.
+    """
+    sample_text = model.sample_text
+
+    async def timed(*args, **kwargs) -> str:
+        start = time.perf_counter()
+        try:
+            return await sample_text(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    model.sample_text = timed
+
+
+async def load(requests: int, concurrency: int, run) -> dict:
+    """
+    Calls `run(i)` for every request, with at most `concurrency` of them running at a time.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+    failures = []
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await run(i)
+            except Exception as e:
+                failures.append(f"{type(e).__name__}: {e}")
+                return
+            samples.append(time.perf_counter() - start)
+
+    with Timer() as timer:
+        await asyncio.gather(*(one(i) for i in range(requests)))
+    return {
+        "seconds": timer.seconds,
+        "requests": requests,
+        "requests_per_second": len(samples) / timer.seconds if timer.seconds > 0 else None,
+        "failures": len(failures),
+        "errors": sorted(set(failures))[:5],
+        "latency": percentiles(samples),
+    }
+
+
+async def measure(stub, calls: list[float], requests: int, concurrency: int, run) -> dict:
+    before = stub.requests
+    stub.peak_in_flight = 0
+    calls.clear()
+    result = await load(requests, concurrency, run)
+    result["model_calls"] = stub.requests - before
+    result["model_calls_per_request"] = result["model_calls"] / requests
+    result["call_latency"] = percentiles(calls)
+    result["peak_in_flight"] = stub.peak_in_flight
+    return result
+
+
+async def main(arguments: argparse.Namespace) -> None:
+    # The model logs every prompt at INFO, which would drown the report.
+    logging.basicConfig(level=logging.WARNING)
+    stub = from_arguments(arguments)
+    # The Ollama client reads its address when it is created, on the first call.
+    os.environ["OLLAMA_HOST"] = await stub.start()
+
+    corpus = Corpus(
+        guilds=1,
+        channels=arguments.channels,
+        users=arguments.users,
+        messages=arguments.messages,
+        days=arguments.days,
+        seed=arguments.seed,
+    )
+    rows = list(corpus.rows())
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = await open_database(os.path.join(directory, "benchmark.db"))
+        try:
+            await database.add_msgs(rows)
+
+            from cogs.llm import LLM
+
+            bot = make_bot(database)
+            bot.config = {
+                "llm_context_window": arguments.context_window,
+                "llm_parallelism": arguments.parallelism,
+                "llm_concurrency": arguments.llm_concurrency,
+            }
+            cog = LLM(bot)
+            if arguments.no_cache:
+                cog.model._cache = None
+            calls = []
+            time_calls(cog.model, calls)
+
+            guild = FakeGuild(corpus.guild_ids[0])
+            # Each reduction gets a different window of the corpus, as different channels would.
+            texts = await cog.format_messages(
+                [(row[0], row[1], row[3], row[4]) for row in rows], guild.id
+            )
+            size = max(1, min(len(texts), arguments.reduce_messages))
+
+            async def reduce(i: int) -> None:
+                start = (i * size // 2) % max(1, len(texts) - size + 1)
+                await cog.model.reduce_text(
+                    command=f"Summarise part {i} of the following conversation.\n",
+                    text=texts[start : start + size],
+                    job=cog.scheduler.job(guild.id),
+                    parallelism=arguments.parallelism,
+                )
+
+            results["reduce_text"] = await measure(
+                stub, calls, arguments.requests, arguments.concurrency, reduce
+            )
+            results["reduce_text"]["messages_per_request"] = size
+
+            flags = make_flags(HistoryFlags, since=timedelta(hours=arguments.since_hours))
+            contexts = []
+
+            async def query(i: int) -> None:
+                context = FakeContext(guild)
+                contexts.append(context)
+                await LLM.query.callback(cog, context, f"What was discussed, question {i}?", flags=flags)
+
+            results["query"] = await measure(
+                stub, calls, arguments.requests, arguments.concurrency, query
+            )
+            results["query"]["messages_sent"] = sum(len(context.sent) for context in contexts)
+            results["cache"] = cog.cache.stats()
+            results["scheduler_deduplicated"] = cog.scheduler.deduplicated
+        finally:
+            await database.connection.close()
+            await stub.close()
+
+    results["stub"] = stub.stats()
+    parameters = corpus.parameters()
+    parameters.update(
+        requests=arguments.requests,
+        concurrency=arguments.concurrency,
+        llm_concurrency=arguments.llm_concurrency,
+        parallelism=arguments.parallelism,
+        context_window=arguments.context_window,
+        reduce_messages=arguments.reduce_messages,
+        since_hours=arguments.since_hours,
+        cache=not arguments.no_cache,
+        latency=arguments.latency,
+        tokens_per_second=arguments.tokens_per_second,
+        response_tokens=arguments.response_tokens,
+        failure_rate=arguments.failure_rate,
+    )
+    report("llm", parameters, results, arguments.output)
+
+
+def parse_arguments(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=16, help="Requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests running at the same time.")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Model calls running at the same time.")
+    parser.add_argument("--parallelism", type=int, default=4, help="Chunks of one request sampled at the same time.")
+    parser.add_argument("--context-window", type=int, default=8192)
+    parser.add_argument("--reduce-messages", type=int, default=1000, help="Messages reduced by each reduce_text request.")
+    parser.add_argument("--since-hours", type=float, default=6, help="The history each !query reads.")
+    parser.add_argument("--no-cache", action="store_true", help="Send every call to the model.")
+    parser.add_argument("--output", help="Write the JSON report here instead of to standard output.")
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_arguments()))
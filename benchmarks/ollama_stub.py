@@ -0,0 +1,207 @@
+"""
+A local stand-in for Ollama's `/api/generate`, with a predictable speed and injectable failures.
+
+    python -m benchmarks.ollama_stub --port 11434 --latency 0.2 --tokens-per-second 40
+
+Point the bot, or a benchmark, at it with `OLLAMA_HOST=http://127.0.0.1:11434`. The response to a
+prompt is derived from the prompt's hash, so the same prompt always gets the same text.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+_WORDS = (
+    "the", "channel", "discussed", "plans", "for", "the", "weekend", "and", "several", "people",
+    "asked", "about", "deadlines", "while", "others", "shared", "links", "to", "music", "games",
+    "someone", "suggested", "a", "meeting", "on", "friday", "everyone", "agreed", "that", "it",
+)
+
+
+class OllamaStub:
+    def __init__(
+        self,
+        *,
+        latency: float = 0.1,
+        tokens_per_second: float = 50.0,
+        response_tokens: int = 64,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        """
+        Serves `/api/generate` like Ollama, streamed or not.
+
+        :param latency: The number of seconds before the first token, the prompt evaluation.
+        :param tokens_per_second: The speed at which tokens are generated, `0` for no delay.
+        :param response_tokens: The length of a response, capped by the request's `num_predict`.
+        :param failure_rate: The fraction of requests answered with an HTTP 500.
+        :param seed: Makes the injected failures reproducible.
+        """
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.prompt_characters = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._random = random.Random(seed)
+        self._runner: web.AppRunner | None = None
+
+    def application(self) -> web.Application:
+        """
+        The web application, for embedding the stub in another server.
+        """
+        app = web.Application()
+        app.router.add_post("/api/generate", self._generate)
+        app.router.add_get("/api/version", self._version)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Starts listening.
+
+        :param host: The address to listen on.
+        :param port: The port to listen on, `0` picks a free one.
+        :return: The base URL of the stub, for `OLLAMA_HOST`.
+        """
+        self._runner = web.AppRunner(self.application(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        """
+        Stops listening.
+        """
+        if self._runner is not None:
+            runner, self._runner = self._runner, None
+            await runner.cleanup()
+
+    def stats(self) -> dict:
+        """
+        What the stub has served so far.
+        """
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "prompt_characters": self.prompt_characters,
+            "peak_in_flight": self.peak_in_flight,
+        }
+
+    def respond(self, prompt: str, limit: int) -> list[str]:
+        """
+        The tokens of the response to `prompt`.
+        """
+        generator = random.Random(hashlib.sha256(prompt.encode()).digest())
+        count = min(self.response_tokens, limit) if limit > 0 else self.response_tokens
+        return [
+            ("" if i == 0 else " ") + generator.choice(_WORDS) for i in range(count)
+        ] + ["."]
+
+    async def _version(self, request: web.Request) -> web.Response:
+        return web.json_response({"version": "0.0.0-stub"})
+
+    async def _generate(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        prompt = body.get("prompt", "")
+        self.prompt_characters += len(prompt)
+        if self._random.random() < self.failure_rate:
+            self.failures += 1
+            return web.json_response({"error": "injected failure"}, status=500)
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            start = time.perf_counter_ns()
+            options = body.get("options") or {}
+            tokens = self.respond(prompt, options.get("num_predict", -1))
+            await asyncio.sleep(self.latency)
+            delay = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+
+            def chunk(text: str, done: bool) -> dict:
+                data = {
+                    "model": body.get("model", "stub"),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "response": text,
+                    "done": done,
+                }
+                if done:
+                    data.update(
+                        done_reason="stop",
+                        total_duration=time.perf_counter_ns() - start,
+                        prompt_eval_count=len(prompt) // 4,
+                        eval_count=len(tokens),
+                    )
+                return data
+
+            if not body.get("stream", True):
+                await asyncio.sleep(delay * len(tokens))
+                return web.json_response(chunk("".join(tokens), True))
+
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            for token in tokens:
+                if delay:
+                    await asyncio.sleep(delay)
+                await response.write(json.dumps(chunk(token, False)).encode() + b"\n")
+            await response.write(json.dumps(chunk("", True)).encode() + b"\n")
+            await response.write_eof()
+            return response
+        finally:
+            self.in_flight -= 1
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the options of the stub to a command line parser.
+    """
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds before the first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="0 for no delay between tokens.")
+    parser.add_argument("--response-tokens", type=int, default=64, help="Tokens per response.")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests that fail with HTTP 500.")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def from_arguments(arguments: argparse.Namespace) -> OllamaStub:
+    """
+    Creates a stub from the options added by `add_arguments`.
+    """
+    return OllamaStub(
+        latency=arguments.latency,
+        tokens_per_second=arguments.tokens_per_second,
+        response_tokens=arguments.response_tokens,
+        failure_rate=arguments.failure_rate,
+        seed=arguments.seed,
+    )
+
+
+async def serve(arguments: argparse.Namespace) -> None:
+    stub = from_arguments(arguments)
+    url = await stub.start(arguments.host, arguments.port)
+    print(f"Serving a stub of the Ollama API on {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    add_arguments(parser)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
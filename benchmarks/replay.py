@@ -0,0 +1,664 @@
+"""
+Replays gateway events through the whole bot, offline, to measure ingestion and command throughput.
+
+    python -m benchmarks.replay --events 50000 --rate 200 --output replay.json
+    python -m benchmarks.replay --duration 14400 --rate 50 --sample-interval 60
+
+`DiscordBot` is started as it would be in production, cogs, database, message buffer and watchdog
+included, but it talks to a fake gateway connection and a fake REST API. The events are fed to the
+same parsers the websocket uses, so `on_message` and `process_commands` see real `discord.Message`
+objects, and everything the bot sends is answered and counted by the fake API. The LLM commands are
+answered by the Ollama stub of `benchmarks.ollama_stub`.
+
+The stream is synthetic, built from `benchmarks.corpus` with a mix of commands, edits and deletions,
+or recorded: one gateway dispatch `{"t": ..., "d": ...}` per line, as `--record` writes them.
+"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.common import Timer, percentiles, report
+from benchmarks.corpus import Corpus, snowflake
+from benchmarks.ollama_stub import OllamaStub
+
+_BOT_ID = 900000
+_OWNER_ID = 200000
+
+_DEFAULT_COMMANDS = (
+    "ping",
+    "serverinfo",
+    "8ball Will the replay finish?",
+    "topUsers",
+    "frequency since:1d",
+    "query What was discussed? since:1h",
+)
+
+
+def current_memory() -> int | None:
+    """
+    The resident memory of the process in bytes, `None` where it cannot be measured.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _timestamp(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+def user_payload(user_id: int, *, bot: bool = False) -> dict:
+    return {
+        "id": str(user_id),
+        "username": f"user-{user_id}",
+        "global_name": None,
+        "discriminator": "0",
+        "avatar": None,
+        "bot": bot,
+    }
+
+
+def guild_payload(guild_id: int, channel_ids: list[int], member_count: int) -> dict:
+    """
+    A `GUILD_CREATE` for a guild with text channels, where everyone may use every command.
+    """
+    now = _timestamp(time.time())
+    return {
+        "id": str(guild_id),
+        "name": f"guild-{guild_id}",
+        "icon": None,
+        "owner_id": str(_OWNER_ID),
+        "unavailable": False,
+        "member_count": member_count,
+        "large": False,
+        "features": [],
+        "emojis": [],
+        "stickers": [],
+        "premium_tier": 0,
+        "verification_level": 0,
+        "default_message_notifications": 0,
+        "explicit_content_filter": 0,
+        "mfa_level": 0,
+        "nsfw_level": 0,
+        "preferred_locale": "en-US",
+        "joined_at": now,
+        # The @everyone role shares the guild's ID, administrator lets every check pass.
+        "roles": [
+            {
+                "id": str(guild_id),
+                "name": "@everyone",
+                "permissions": "8",
+                "position": 0,
+                "color": 0,
+                "hoist": False,
+                "managed": False,
+                "mentionable": False,
+            }
+        ],
+        "channels": [
+            {
+                "id": str(channel_id),
+                "type": 0,
+                "name": f"channel-{channel_id}",
+                "position": position,
+                "permission_overwrites": [],
+                "nsfw": False,
+                "parent_id": None,
+            }
+            for position, channel_id in enumerate(channel_ids)
+        ],
+        "members": [
+            {
+                "user": user_payload(_BOT_ID, bot=True),
+                "roles": [],
+                "joined_at": now,
+                "deaf": False,
+                "mute": False,
+                "flags": 0,
+            }
+        ],
+        "threads": [],
+        "voice_states": [],
+        "presences": [],
+        "stage_instances": [],
+        "guild_scheduled_events": [],
+    }
+
+
+def message_payload(
+    message_id: int, channel_id: int, guild_id: int | None, author: dict, content: str, **extra
+) -> dict:
+    """
+    A message as the gateway and the REST API describe it.
+    """
+    data = {
+        "id": str(message_id),
+        "channel_id": str(channel_id),
+        "author": author,
+        "content": content,
+        "timestamp": _timestamp(((message_id >> 22) + 1420070400000) / 1000),
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+        "flags": 0,
+    }
+    if guild_id is not None:
+        data["guild_id"] = str(guild_id)
+        data["member"] = {"roles": [], "joined_at": data["timestamp"], "deaf": False, "mute": False, "flags": 0}
+    data.update(extra)
+    return data
+
+
+class Sequence:
+    """
+    Hands out message IDs for the current time, as Discord would.
+    """
+
+    def __init__(self) -> None:
+        self._counter = itertools.count()
+
+    def __call__(self) -> int:
+        return snowflake(time.time(), next(self._counter))
+
+
+class Gateway:
+    def __init__(self, bot, *, latency: float = 0.05) -> None:
+        """
+        Stands in for the `DiscordWebSocket` of a connected bot and feeds it gateway dispatches.
+
+        :param bot: The bot the events are dispatched to.
+        :param latency: The heartbeat latency the bot reports, in seconds.
+        """
+        self.bot = bot
+        self.latency = latency
+        self.open = True
+        self.presences = 0
+        self.shard_id = None
+
+    def dispatch(self, event: str, data: dict) -> None:
+        """
+        Parses a dispatch with the parser the websocket would use, which schedules the listeners.
+        """
+        parser = self.bot._connection.parsers.get(event)
+        if parser is not None:
+            parser(data)
+
+    async def change_presence(self, **kwargs) -> None:
+        self.presences += 1
+
+    def is_ratelimited(self) -> bool:
+        return False
+
+    async def close(self, code: int = 1000) -> None:
+        self.open = False
+
+
+class DiscordAPI:
+    def __init__(self, *, sequence: Sequence, latency: float = 0.0) -> None:
+        """
+        Answers the REST requests of the bot without a network, every request is counted by route.
+
+        Sent and edited messages are echoed back, history is empty and everything else gets an
+        empty response.
+
+        :param sequence: Hands out the IDs of the messages the bot sends.
+        :param latency: The number of seconds every request takes.
+        """
+        self.sequence = sequence
+        self.latency = latency
+        self.requests: collections.Counter[str] = collections.Counter()
+        self.files = 0
+        self.file_bytes = 0
+        self.bot_user = user_payload(_BOT_ID, bot=True)
+
+    def install(self, bot) -> None:
+        """
+        Routes every request of `bot` here instead of to Discord.
+        """
+        bot.http.request = self.request
+
+    async def request(self, route, *, files=None, form=None, **kwargs):
+        self.requests[f"{route.method} {route.path}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for file in files or ():
+            # Reading the attachment is part of what uploading it would cost.
+            self.file_bytes += len(file.fp.read())
+            self.files += 1
+
+        payload = kwargs.get("json") or {}
+        if form:
+            for field in form:
+                if field.get("name") == "payload_json":
+                    payload = json.loads(field["value"])
+
+        if route.path == "/users/@me":
+            return self.bot_user
+        if route.path == "/oauth2/applications/@me":
+            return {
+                "id": str(_BOT_ID),
+                "name": "replay",
+                "description": "",
+                "icon": None,
+                "bot_public": True,
+                "bot_require_code_grant": False,
+                "verify_key": "",
+                "flags": 0,
+                "owner": user_payload(_OWNER_ID),
+            }
+        if route.path == "/users/{user_id}":
+            return user_payload(int(route.url.rsplit("/", 1)[1]))
+        if route.path == "/channels/{channel_id}/messages":
+            if route.method == "GET":
+                return []
+            if route.method == "POST":
+                return message_payload(
+                    self.sequence(),
+                    route.channel_id,
+                    None,
+                    self.bot_user,
+                    payload.get("content") or "",
+                    embeds=payload.get("embeds") or [],
+                )
+        if route.path == "/channels/{channel_id}/messages/{message_id}" and route.method == "PATCH":
+            return message_payload(
+                int(route.url.rsplit("/", 1)[1]),
+                route.channel_id,
+                None,
+                self.bot_user,
+                payload.get("content") or "",
+                embeds=payload.get("embeds") or [],
+            )
+        return None
+
+
+def synthetic_stream(
+    corpus: Corpus,
+    *,
+    sequence: Sequence,
+    prefix: str,
+    commands: list[str],
+    command_rate: float,
+    edit_rate: float,
+    delete_rate: float,
+    seed: int,
+):
+    """
+    Generates gateway dispatches, the guilds first, then messages made from the corpus.
+
+    The messages get IDs and timestamps for the moment they are generated, so they look live to the
+    bot however long the replay runs. Edits and deletions target recent messages.
+    """
+    generator = random.Random(seed)
+    for guild_id in corpus.guild_ids:
+        yield "GUILD_CREATE", guild_payload(guild_id, corpus.channel_ids[guild_id], corpus.users)
+
+    recent = collections.deque(maxlen=1000)
+    for _, channel_id, guild_id, user_id, content, _ in corpus.rows():
+        roll = generator.random()
+        if roll < edit_rate and recent:
+            message_id, channel_id, guild_id, user_id = generator.choice(recent)
+            yield "MESSAGE_UPDATE", message_payload(
+                message_id,
+                channel_id,
+                guild_id,
+                user_payload(user_id),
+                content,
+                edited_timestamp=_timestamp(time.time()),
+            )
+            continue
+        roll -= edit_rate
+        if roll < delete_rate and recent:
+            message_id, channel_id, guild_id, _ = recent.popleft()
+            yield "MESSAGE_DELETE", {
+                "id": str(message_id),
+                "channel_id": str(channel_id),
+                "guild_id": str(guild_id),
+            }
+            continue
+        roll -= delete_rate
+        if roll < command_rate and commands:
+            content = prefix + generator.choice(commands)
+        message_id = sequence()
+        recent.append((message_id, channel_id, guild_id, user_id))
+        yield "MESSAGE_CREATE", message_payload(
+            message_id, channel_id, guild_id, user_payload(user_id), content
+        )
+
+
+def recorded_stream(path: str):
+    """
+    Reads gateway dispatches, one `{"t": ..., "d": ...}` object per line.
+    """
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                event = json.loads(line)
+                yield event["t"], event["d"]
+
+
+class Reservoir:
+    def __init__(self, size: int = 10000, *, seed: int = 0) -> None:
+        """
+        Keeps a uniform sample of at most `size` values, so hours of timings fit in constant memory.
+        """
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.samples: list[float] = []
+        self._random = random.Random(seed)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            i = self._random.randrange(self.count)
+            if i < self.size:
+                self.samples[i] = value
+
+    def summary(self) -> dict:
+        result = percentiles(self.samples)
+        result["count"] = self.count
+        if self.count:
+            result["mean"] = self.total / self.count
+        return result
+
+
+def instrument(bot_class):
+    """
+    A subclass of the bot that times every listener it runs and counts the pending ones.
+    """
+
+    class ReplayBot(bot_class):
+        def __init__(self) -> None:
+            super().__init__()
+            self.timings: dict[str, Reservoir] = collections.defaultdict(Reservoir)
+            self.errors: collections.Counter[str] = collections.Counter()
+            self.pending = 0
+            self.idle = asyncio.Event()
+            self.idle.set()
+
+        def _schedule_event(self, coro, event_name, *args, **kwargs):
+            self.pending += 1
+            self.idle.clear()
+            return super()._schedule_event(coro, event_name, *args, **kwargs)
+
+        async def _run_event(self, coro, event_name, *args, **kwargs) -> None:
+            start = time.perf_counter()
+            try:
+                await super()._run_event(coro, event_name, *args, **kwargs)
+            finally:
+                self.timings[self.classify(event_name, args)].add(time.perf_counter() - start)
+                self.pending -= 1
+                if not self.pending:
+                    self.idle.set()
+
+        def classify(self, event_name: str, args: tuple) -> str:
+            if event_name == "on_message":
+                content = args[0].content
+                prefix = self.config["prefix"]
+                if content.startswith(prefix) and len(content) > len(prefix):
+                    return "command " + content[len(prefix) :].split()[0]
+                return "message"
+            if event_name == "on_command_error":
+                self.errors[type(args[1]).__name__] += 1
+            return event_name
+
+    return ReplayBot
+
+
+async def main(arguments: argparse.Namespace) -> None:
+    if not arguments.verbose:
+        logging.getLogger("discord").setLevel(logging.ERROR)
+    import bot as application
+
+    if not arguments.verbose:
+        application.logger.setLevel(logging.WARNING)
+
+    # The LLM commands and the summaries precomputed in the background talk to the stub.
+    stub = OllamaStub(latency=arguments.llm_latency, tokens_per_second=0, response_tokens=32)
+    os.environ["OLLAMA_HOST"] = await stub.start()
+    logging.basicConfig(level=logging.WARNING)
+
+    sequence = Sequence()
+    if arguments.input:
+        stream = recorded_stream(arguments.input)
+    else:
+        corpus = Corpus(
+            guilds=arguments.guilds,
+            channels=arguments.channels,
+            users=arguments.users,
+            # The corpus only provides authors, channels and text, a long one costs nothing.
+            messages=arguments.events or 10**9,
+            days=1,
+            seed=arguments.seed,
+        )
+        stream = synthetic_stream(
+            corpus,
+            sequence=sequence,
+            prefix=application.config["prefix"],
+            commands=arguments.commands,
+            command_rate=arguments.command_rate,
+            edit_rate=arguments.edit_rate,
+            delete_rate=arguments.delete_rate,
+            seed=arguments.seed,
+        )
+    record = open(arguments.record, "w") if arguments.record else None
+    results = {}
+    samples = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot = instrument(application.DiscordBot)()
+        bot.config = dict(bot.config, metrics_port=arguments.metrics_port)
+        bot.database_path = os.path.join(directory, "replay.db")
+        bot._connection.guild_ready_timeout = 0.1
+        api = DiscordAPI(sequence=sequence, latency=arguments.http_latency)
+        api.install(bot)
+        gateway = Gateway(bot)
+        bot.ws = gateway
+
+        with Timer() as timer:
+            await bot.login("replay")
+        results["startup_seconds"] = timer.seconds
+        try:
+            # The guilds come first in every stream, they are created during READY as on a connect.
+            stream = iter(stream)
+            guilds = []
+            event = next(stream, None)
+            while event is not None and event[0] == "GUILD_CREATE":
+                guilds.append(event)
+                event = next(stream, None)
+            gateway.dispatch("READY", {
+                "v": 10,
+                "user": api.bot_user,
+                "guilds": [{"id": data["id"], "unavailable": True} for _, data in guilds],
+                "session_id": "replay",
+                "resume_gateway_url": "wss://gateway.invalid",
+                "application": {"id": str(_BOT_ID), "flags": 0},
+            })
+            for name, data in guilds:
+                gateway.dispatch(name, data)
+                if not arguments.no_capture:
+                    await bot.database.set_capture(int(data["id"]), int(data["id"]), True)
+                    bot.capture_targets.add(int(data["id"]))
+                if record is not None:
+                    record.write(json.dumps({"t": name, "d": data}) + "\n")
+            await bot.wait_until_ready()
+
+            counts: collections.Counter[str] = collections.Counter()
+            memory_before = current_memory()
+            start = last_sample = time.perf_counter()
+            last_events = 0
+            deadline = start + arguments.duration if arguments.duration else None
+            events = itertools.chain([event] if event is not None else [], stream)
+            if arguments.events:
+                events = itertools.islice(events, arguments.events)
+
+            def sample(now: float) -> None:
+                nonlocal last_sample, last_events
+                total = sum(counts.values())
+                point = {
+                    "seconds": now - start,
+                    "events": total,
+                    "events_per_second": (total - last_events) / (now - last_sample),
+                    "memory": current_memory(),
+                    "pending": bot.pending,
+                    "buffered": len(bot.message_buffer),
+                    "tasks": len(asyncio.all_tasks()),
+                }
+                samples.append(point)
+                last_sample, last_events = now, total
+                print(
+                    f"{point['seconds']:8.0f}s {total:>10} events {point['events_per_second']:>8.0f}/s "
+                    f"{(point['memory'] or 0) / 1024 / 1024:>8.1f}MB {point['pending']:>5} pending",
+                    file=sys.stderr,
+                )
+
+            with Timer() as timer:
+                for i, (name, data) in enumerate(events):
+                    if record is not None:
+                        record.write(json.dumps({"t": name, "d": data}) + "\n")
+                    gateway.dispatch(name, data)
+                    counts[name] += 1
+                    if arguments.rate:
+                        delay = start + (i + 1) / arguments.rate - time.perf_counter()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    # Yielding every event lets the listeners run as they would between frames.
+                    await asyncio.sleep(0)
+                    while bot.pending >= arguments.max_pending:
+                        await asyncio.sleep(0.001)
+                    now = time.perf_counter()
+                    if now - last_sample >= arguments.sample_interval:
+                        sample(now)
+                    if deadline is not None and now >= deadline:
+                        break
+                dispatched = time.perf_counter() - timer.start
+                await bot.idle.wait()
+            sample(time.perf_counter())
+            await bot.message_buffer.flush()
+
+            rows = await bot.database.connection.execute("SELECT COUNT(*) FROM logs")
+            async with rows as cursor:
+                stored = (await cursor.fetchone())[0]
+            total = sum(counts.values())
+            results["replay"] = {
+                "seconds": timer.seconds,
+                "events": total,
+                "events_per_second": total / timer.seconds if timer.seconds > 0 else None,
+                # Without the time spent waiting for the last commands to finish.
+                "dispatch_seconds": dispatched,
+                "dispatched_per_second": total / dispatched if dispatched > 0 else None,
+                "by_event": dict(counts),
+                "messages_stored": stored,
+            }
+            results["processing"] = {
+                kind: reservoir.summary() for kind, reservoir in sorted(bot.timings.items())
+            }
+            results["command_errors"] = dict(bot.errors)
+            results["outbound"] = {
+                "requests": sum(api.requests.values()),
+                "by_route": dict(api.requests.most_common()),
+                "files": api.files,
+                "file_bytes": api.file_bytes,
+                "presence_updates": gateway.presences,
+            }
+            results["llm_stub"] = stub.stats()
+            memory_after = current_memory()
+            if memory_before is not None and memory_after is not None:
+                results["memory"] = {
+                    "before": memory_before,
+                    "after": memory_after,
+                    "growth": memory_after - memory_before,
+                    "growth_per_hour": (memory_after - memory_before) / timer.seconds * 3600
+                    if timer.seconds > 0 else None,
+                    "peak": application.peak_memory(),
+                    "with_workers": application.tree_memory(),
+                }
+            results["samples"] = samples
+        finally:
+            if record is not None:
+                record.close()
+            await bot.close()
+            await stub.close()
+
+    parameters = {
+        "input": arguments.input,
+        "events": arguments.events,
+        "duration": arguments.duration,
+        "rate": arguments.rate,
+        "max_pending": arguments.max_pending,
+        "http_latency": arguments.http_latency,
+        "llm_latency": arguments.llm_latency,
+        "capture": not arguments.no_capture,
+    }
+    if not arguments.input:
+        parameters.update(corpus.parameters())
+        parameters.update(
+            commands=arguments.commands,
+            command_rate=arguments.command_rate,
+            edit_rate=arguments.edit_rate,
+            delete_rate=arguments.delete_rate,
+        )
+        del parameters["messages"], parameters["days"]
+    report("replay", parameters, results, arguments.output)
+
+
+def parse_arguments(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input", help="Replay the gateway dispatches recorded in this file.")
+    parser.add_argument("--record", help="Write the replayed dispatches to this file.")
+    parser.add_argument("--events", type=int, default=None, help="Stop after this many events.")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds.")
+    parser.add_argument("--rate", type=float, default=0, help="Events per second, 0 for as fast as possible.")
+    parser.add_argument("--max-pending", type=int, default=256, help="Listeners running at once before the replay waits.")
+    parser.add_argument("--sample-interval", type=float, default=10, help="Seconds between progress samples.")
+    parser.add_argument("--guilds", type=int, default=2)
+    parser.add_argument("--channels", type=int, default=8, help="Channels per guild.")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--command",
+        dest="commands",
+        action="append",
+        help="A command, without the prefix, in the synthetic stream. Can be repeated.",
+    )
+    parser.add_argument("--command-rate", type=float, default=0.01, help="Fraction of messages that are commands.")
+    parser.add_argument("--edit-rate", type=float, default=0.02, help="Fraction of events that edit a message.")
+    parser.add_argument("--delete-rate", type=float, default=0.01, help="Fraction of events that delete a message.")
+    parser.add_argument("--no-capture", action="store_true", help="Do not log the replayed messages.")
+    parser.add_argument("--http-latency", type=float, default=0.0, help="Seconds every REST request takes.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds every call to the Ollama stub takes.")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve the metrics endpoint on this port.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's INFO logs.")
+    parser.add_argument("--output", help="Write the JSON report here instead of to standard output.")
+    arguments = parser.parse_args(argv)
+    if arguments.commands is None:
+        arguments.commands = list(_DEFAULT_COMMANDS)
+    if arguments.events is None and arguments.duration is None and arguments.input is None:
+        arguments.events = 10000
+    return arguments
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_arguments()))
@@ -0,0 +1,172 @@
+"""
+Benchmarks the storage and analytics hot paths against an on-disk SQLite file.
+
+    python -m benchmarks.storage --messages 100000 --output storage.json
+
+Measures `DatabaseManager.add_msg` and the batched writes of the message buffer, word indexing,
+`get_msgs`, and the `!topUsers`, `!frequency` and `!dump` commands end to end. Nothing touches the
+network, authors are resolved from a fake gateway cache.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import types
+
+from benchmarks.common import FakeContext, FakeGuild, Timer, open_database, report, throughput
+from benchmarks.corpus import Corpus
+from helpers.converters import DumpFlags, FrequencyFlags, HistoryFlags
+from helpers.names import NameResolver
+
+
+def make_flags(cls, **values):
+    """
+    Builds flags as if they had been typed after a command, unset flags get their defaults.
+    """
+    flags = cls.__new__(cls)
+    for flag in cls.get_flags().values():
+        setattr(flags, flag.attribute, values.get(flag.attribute, flag.default))
+    return flags
+
+
+def make_bot(database):
+    """
+    The parts of `DiscordBot` the Analysis cog uses, with every author in the gateway cache.
+    """
+    bot = types.SimpleNamespace(
+        database=database,
+        config={},
+        get_user=lambda user_id: types.SimpleNamespace(name=f"user-{user_id}"),
+        get_guild=lambda guild_id: None,
+        get_channel=lambda channel_id: None,
+    )
+    bot.names = NameResolver(bot)
+    return bot
+
+
+async def run_command(command, cog, context: FakeContext, flags, repeat: int) -> dict:
+    # The first run starts the worker processes and loads spaCy, which is not what is measured.
+    await command.callback(cog, context, flags=flags)
+    samples = []
+    for _ in range(repeat):
+        context.sent.clear()
+        with Timer() as timer:
+            await command.callback(cog, context, flags=flags)
+        samples.append(timer.seconds)
+    return {
+        "runs": repeat,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "max": max(samples),
+        "messages_sent": len(context.sent),
+    }
+
+
+async def main(arguments: argparse.Namespace) -> None:
+    corpus = Corpus(
+        guilds=arguments.guilds,
+        channels=arguments.channels,
+        users=arguments.users,
+        messages=arguments.messages,
+        days=arguments.days,
+        seed=arguments.seed,
+    )
+    rows = list(corpus.rows())
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark.db")
+        database = await open_database(path)
+        try:
+            # One transaction per message, as every `add_msg` call commits.
+            single = rows[: arguments.single_writes]
+            with Timer() as timer:
+                for row in single:
+                    await database.add_msg(*row)
+            results["add_msg"] = throughput(timer.seconds, len(single))
+
+            # The path live capture and scraping take, through the message buffer's batches.
+            batched = rows[arguments.single_writes :]
+            with Timer() as timer:
+                for i in range(0, len(batched), arguments.batch_size):
+                    await database.add_msgs(batched[i : i + arguments.batch_size])
+            results["add_msgs"] = throughput(timer.seconds, len(batched))
+            results["add_msgs"]["batch_size"] = arguments.batch_size
+
+            with Timer() as timer:
+                indexed = 0
+                while True:
+                    count = await database.index_terms()
+                    if not count:
+                        break
+                    indexed += count
+            results["index_terms"] = throughput(timer.seconds, indexed)
+
+            with Timer() as timer:
+                read = 0
+                for guild_id in corpus.guild_ids:
+                    read += len(await database.get_msgs(guild_id))
+            results["get_msgs"] = throughput(timer.seconds, read)
+
+            from cogs.analysis import Analysis
+
+            bot = make_bot(database)
+            cog = Analysis(bot)
+            cog.nlp.start()
+            try:
+                guild = FakeGuild(corpus.guild_ids[0])
+                context = FakeContext(guild)
+                results["top_users"] = await run_command(
+                    Analysis.top_users, cog, context, make_flags(HistoryFlags), arguments.repeat
+                )
+                results["frequency"] = await run_command(
+                    Analysis.frequency, cog, context, make_flags(FrequencyFlags), arguments.repeat
+                )
+                for format in ("ndjson", "csv"):
+                    context.sent.clear()
+                    with Timer() as timer:
+                        await Analysis.dump.callback(
+                            cog, context, flags=make_flags(DumpFlags, format=format)
+                        )
+                    exported = sum(1 for row in rows if row[2] == guild.id)
+                    results[f"dump_{format}"] = throughput(timer.seconds, exported)
+                    results[f"dump_{format}"]["files"] = sum(1 for sent in context.sent if "file" in sent)
+            finally:
+                await cog.nlp.close()
+                await cog.charts.close()
+
+            results["database_bytes"] = sum(
+                os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+            )
+        finally:
+            await database.connection.close()
+
+    parameters = corpus.parameters()
+    parameters.update(
+        single_writes=arguments.single_writes,
+        batch_size=arguments.batch_size,
+        repeat=arguments.repeat,
+        characters=sum(len(row[4]) for row in rows),
+    )
+    report("storage", parameters, results, arguments.output)
+
+
+def parse_arguments(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=2)
+    parser.add_argument("--channels", type=int, default=8, help="Channels per guild.")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--single-writes", type=int, default=2000, help="Messages written one add_msg call at a time.")
+    parser.add_argument("--batch-size", type=int, default=512, help="Messages per add_msgs batch.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of every command.")
+    parser.add_argument("--output", help="Write the JSON report here instead of to standard output.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_arguments()))
@@ -12,14 +12,22 @@ import os
 import platform
 import random
 import sys
+import time
+
+# Measured before the third-party imports, so the startup report covers them too.
+STARTED_AT = time.perf_counter()
 
 import aiosqlite
 import discord
 from discord.ext import commands, tasks
 from discord.ext.commands import Context
-from dotenv import load_dotenv
 
-from database import DatabaseManager
+from database import DatabaseManager, MessageBuffer
+from database.migrations import migrate
+from helpers.metrics import COMMAND_LATENCY, MetricsServer
+from helpers.names import NameResolver
+from helpers.watchdog import LoopWatchdog
+from helpers.web import WebClient
 
 if not os.path.isfile(f"{os.path.realpath(os.path.dirname(__file__))}/config.json"):
     sys.exit("'config.json' not found! Please add it and try again.")
@@ -115,6 +123,56 @@ logger.addHandler(console_handler)
 logger.addHandler(file_handler)
 
 
+def peak_memory() -> int | None:
+    """
+    The peak resident memory of the process in bytes, `None` where it cannot be measured.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def tree_memory() -> int | None:
+    """
+    The resident memory of the process and of every process it started, such as the NLP and chart
+    workers, in bytes. Pages shared between them are counted once per process, so this is an upper
+    bound. `None` where it cannot be measured.
+    """
+    try:
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        children = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as file:
+                    stat = file.read()
+            except OSError:
+                # The process exited in the meantime.
+                continue
+            # The command name may contain spaces and parentheses, the state and parent follow it.
+            parent = int(stat[stat.rindex(")") + 2 :].split()[1])
+            children.setdefault(parent, []).append(int(entry))
+
+        total = 0
+        pending = [os.getpid()]
+        while pending:
+            pid = pending.pop()
+            pending.extend(children.get(pid, ()))
+            try:
+                with open(f"/proc/{pid}/statm") as file:
+                    total += int(file.read().split()[1]) * page_size
+            except OSError:
+                continue
+        return total
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
 class DiscordBot(commands.Bot):
     def __init__(self) -> None:
         super().__init__(
@@ -133,11 +191,24 @@ class DiscordBot(commands.Bot):
         self.logger = logger
         self.config = config
         self.database = None
+        self.message_buffer = None
+        self.names = None
+        self.web = None
+        self.metrics = None
+        self.watchdog = LoopWatchdog(
+            threshold=config.get("stall_threshold_ms", 250) / 1000
+        )
+        self.before_invoke(self.track_command)
+        self.capture_targets = set()
+        self.startup_profile = []
+        self.ready_at = None
+        self.database_path = (
+            f"{os.path.realpath(os.path.dirname(__file__))}/database/database.db"
+        )
 
     async def init_db(self) -> None:
-        async with aiosqlite.connect(
-            f"{os.path.realpath(os.path.dirname(__file__))}/database/database.db"
-        ) as db:
+        async with aiosqlite.connect(self.database_path) as db:
+            await migrate(db)
             with open(
                 f"{os.path.realpath(os.path.dirname(__file__))}/database/schema.sql"
             ) as file:
@@ -147,13 +218,26 @@ class DiscordBot(commands.Bot):
     async def load_cogs(self) -> None:
         """
         The code in this function is executed whenever the bot will start.
+
+        Every extension is timed, and one that takes longer than `import_budget_ms` to load is
+        reported, so heavy dependencies are noticed and moved into the functions that use them.
         """
-        for file in os.listdir(f"{os.path.realpath(os.path.dirname(__file__))}/cogs"):
+        budget = self.config.get("import_budget_ms", 250) / 1000
+        for file in sorted(os.listdir(f"{os.path.realpath(os.path.dirname(__file__))}/cogs")):
             if file.endswith(".py"):
                 extension = file[:-3]
                 try:
+                    memory = peak_memory()
+                    start = time.perf_counter()
                     await self.load_extension(f"cogs.{extension}")
+                    elapsed = time.perf_counter() - start
+                    growth = peak_memory() - memory if memory is not None else None
+                    self.startup_profile.append((extension, elapsed, growth))
                     self.logger.info(f"Loaded extension '{extension}'")
+                    if elapsed > budget:
+                        self.logger.warning(
+                            f"Extension '{extension}' took {elapsed * 1000:.0f}ms to load, over the budget of {budget * 1000:.0f}ms"
+                        )
                 except Exception as e:
                     exception = f"{type(e).__name__}: {e}"
                     self.logger.error(
@@ -186,31 +270,189 @@ class DiscordBot(commands.Bot):
             f"Running on: {platform.system()} {platform.release()} ({os.name})"
         )
         self.logger.info("-------------------")
+        self.watchdog.start()
         await self.init_db()
+        connection = await aiosqlite.connect(self.database_path)
+        # WAL lets readers keep going while the message buffer commits its batches.
+        await connection.execute("PRAGMA journal_mode=WAL")
+        await connection.execute("PRAGMA synchronous=NORMAL")
+        self.database = DatabaseManager(connection=connection)
+        self.message_buffer = MessageBuffer(
+            self.database,
+            max_size=self.config.get("buffer_size", 512),
+            interval=self.config.get("buffer_interval", 2.0),
+        )
+        self.message_buffer.start()
+        self.names = NameResolver(
+            self, ttl=self.config.get("name_ttl_days", 7) * 24 * 60 * 60
+        )
+        self.capture_targets = set(await self.database.get_capture_targets())
+        self.web = WebClient(rewrites=self.config.get("http_rewrites"))
+        self.web.start()
+        if self.config.get("metrics_port"):
+            self.metrics = MetricsServer(self, port=self.config["metrics_port"])
+            try:
+                await self.metrics.start()
+            except OSError as e:
+                self.logger.error(f"Failed to serve metrics\n{type(e).__name__}: {e}")
+                self.metrics = None
         await self.load_cogs()
         self.status_task.start()
-        self.database = DatabaseManager(
-            connection=await aiosqlite.connect(
-                f"{os.path.realpath(os.path.dirname(__file__))}/database/database.db"
-            )
+        self.log_startup_profile()
+
+    def log_startup_profile(self) -> None:
+        """
+        Logs how long every extension took to load and how much memory it added.
+
+        The growth of each extension is that of the bot's own process, the total also counts the
+        worker processes started so far.
+        """
+        memory = peak_memory()
+        workers = tree_memory()
+        self.logger.info("Startup profile:")
+        for extension, elapsed, growth in self.startup_profile:
+            growth = f"{growth / 1024 / 1024:+.1f}MB" if growth is not None else "n/a"
+            self.logger.info(f"  {extension:<12} {elapsed * 1000:>7.1f}ms {growth:>9}")
+        self.logger.info(
+            f"  {'total':<12} {(time.perf_counter() - STARTED_AT) * 1000:>7.1f}ms"
+            + (f" {memory / 1024 / 1024:>8.1f}MB peak" if memory is not None else "")
+            + (f", {workers / 1024 / 1024:.1f}MB with workers" if workers is not None else "")
         )
 
+    async def on_ready(self) -> None:
+        """
+        The code in this event is executed every time the bot connects, or reconnects, to Discord.
+        """
+        if self.ready_at is None:
+            self.ready_at = time.perf_counter()
+            memory = tree_memory()
+            self.logger.info(
+                f"Ready {self.ready_at - STARTED_AT:.1f}s after the process started"
+                + (f", {memory / 1024 / 1024:.1f}MB resident with workers" if memory is not None else "")
+            )
+
+    async def close(self) -> None:
+        """
+        Unloads the cogs and disconnects, then drains the message buffer and closes the database and HTTP session.
+
+        Nothing can enqueue messages or use the database once the cogs and the gateway are gone, so
+        the drain is the last write, and the database is closed even if it fails.
+        """
+        try:
+            await super().close()
+        finally:
+            self.watchdog.stop()
+            if self.metrics is not None:
+                await self.metrics.close()
+            if self.web is not None:
+                await self.web.close()
+            try:
+                if self.message_buffer is not None:
+                    await self.message_buffer.close()
+            finally:
+                if self.database is not None:
+                    await self.database.connection.close()
+
     async def on_message(self, message: discord.Message) -> None:
         """
         The code in this event is executed every time someone sends a message, with or without the prefix
 
         :param message: The message that was sent.
         """
+        # The bot's own replies are not logged, the streamed ones are edited every second.
+        if (
+            message.guild is not None
+            and message.author != self.user
+            and self.is_captured(message.guild.id, message.channel.id)
+        ):
+            self.message_buffer.put(message)
         if message.author == self.user or message.author.bot:
             return
         await self.process_commands(message)
 
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        """
+        The code in this event is executed every time a message is edited, even if it is not in the message cache.
+
+        :param payload: The raw event payload data.
+        """
+        author_id = payload.data.get("author", {}).get("id")
+        if (
+            "content" in payload.data
+            and author_id != str(self.user.id)
+            and self.is_captured(payload.guild_id, payload.channel_id)
+        ):
+            self.message_buffer.put_edit(payload.message_id, payload.data["content"])
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        """
+        The code in this event is executed every time a message is deleted, even if it is not in the message cache.
+
+        :param payload: The raw event payload data.
+        """
+        if self.is_captured(payload.guild_id, payload.channel_id):
+            self.message_buffer.put_delete(payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        """
+        The code in this event is executed every time messages are deleted in bulk, for example with `!purge`.
+
+        :param payload: The raw event payload data.
+        """
+        if self.is_captured(payload.guild_id, payload.channel_id):
+            for message_id in payload.message_ids:
+                self.message_buffer.put_delete(message_id)
+
+    def is_captured(self, guild_id: int | None, channel_id: int) -> bool:
+        """
+        Checks whether messages sent in a channel should be logged live.
+
+        :param guild_id: The ID of the guild the channel belongs to, `None` in DMs.
+        :param channel_id: The ID of the channel the message was sent in.
+        """
+        return guild_id is not None and (
+            guild_id in self.capture_targets or channel_id in self.capture_targets
+        )
+
+    async def on_command(self, context: Context) -> None:
+        """
+        The code in this event is executed every time a normal command is invoked.
+
+        :param context: The context of the command that is being executed.
+        """
+        context.started_at = time.perf_counter()
+
+    async def track_command(self, context: Context) -> None:
+        """
+        Runs in the task of every command before it is invoked, so the watchdog can name it.
+
+        :param context: The context of the command that is being executed.
+        """
+        cog = context.cog.qualified_name if context.cog is not None else "bot"
+        self.watchdog.track(f"{cog}.{context.command.qualified_name}")
+
+    def observe_command(self, context: Context, status: str) -> None:
+        """
+        Records how long a command took, for the metrics endpoint.
+
+        :param context: The context of the command that has finished.
+        :param status: Either `ok` or `error`.
+        """
+        started_at = getattr(context, "started_at", None)
+        if started_at is not None and context.command is not None:
+            COMMAND_LATENCY.observe(
+                time.perf_counter() - started_at,
+                command=context.command.qualified_name,
+                status=status,
+            )
+
     async def on_command_completion(self, context: Context) -> None:
         """
         The code in this event is executed every time a normal command has been *successfully* executed.
 
         :param context: The context of the command that has been executed.
         """
+        self.observe_command(context, "ok")
         full_command_name = context.command.qualified_name
         split = full_command_name.split(" ")
         executed_command = str(split[0])
@@ -230,6 +472,7 @@ class DiscordBot(commands.Bot):
         :param context: The context of the normal command that failed executing.
         :param error: The error that has been faced.
         """
+        self.observe_command(context, "error")
         if isinstance(error, commands.CommandOnCooldown):
             minutes, seconds = divmod(error.retry_after, 60)
             hours, minutes = divmod(minutes, 60)
@@ -280,7 +523,10 @@ class DiscordBot(commands.Bot):
             raise error
 
 
-load_dotenv()
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
 
-bot = DiscordBot()
-bot.run(os.getenv("TOKEN"))
+    bot = DiscordBot()
+    bot.run(os.getenv("TOKEN"))
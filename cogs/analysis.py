@@ -1,117 +1,200 @@
 import discord
-from discord.ext import commands
-import spacy
-import matplotlib.pyplot as plt
-from collections import Counter
+from discord.ext import commands, tasks
 import io
+import time
+
+from helpers.converters import DumpFlags, FrequencyFlags, HistoryFlags
+from helpers.charts import ChartRenderer
+from helpers.export import MessageExport
+from helpers.nlp import NLPService
+from helpers.scraper import Scraper
 
 class Analysis(commands.Cog, name="analysis"):
     def __init__(self, bot) -> None:
         self.bot = bot
-
-    @commands.command(name="scrape", description="Scrape all messages in channel!")
+        self.scraper = Scraper(bot)
+        self.nlp = NLPService(processes=bot.config.get("nlp_processes"))
+        self.charts = ChartRenderer()
+
+    async def cog_load(self) -> None:
+        self.nlp.start()
+        self.index_terms.start()
+        self.bot.loop.create_task(self._resume_backfills())
+
+    async def cog_unload(self) -> None:
+        self.scraper.cancel()
+        self.index_terms.cancel()
+        await self.nlp.close()
+        await self.charts.close()
+
+    @tasks.loop(seconds=5.0)
+    async def index_terms(self) -> None:
+        """
+        Tokenizes newly logged, edited and deleted messages into the word-frequency index.
+        """
+        try:
+            indexed = await self.bot.database.index_terms(self.nlp.terms)
+        except Exception as e:
+            self.bot.logger.error(f"Failed to index words\n{type(e).__name__}: {e}")
+            return
+        if indexed >= 10000:
+            self.bot.logger.info(f"Indexed the words of {indexed} messages")
+
+    async def _resume_backfills(self) -> None:
+        await self.bot.wait_until_ready()
+        await self.scraper.resume_backfills()
+
+    @commands.group(name="scrape", description="Scrape new messages in every channel!", invoke_without_command=True)
     async def analyze(self, context: commands.Context) -> None:
         await context.send(embed=discord.Embed(
             title="Scraping messages!"
         ))
 
-        async for message in context.channel.history(limit=1024, before=context.message):
-            await self.bot.database.add_msg(message.author.id, message.guild.id, message.content)
+        start = time.perf_counter()
+        count = await self.scraper.scrape_guild(context.guild)
 
         await context.send(embed=discord.Embed(
-            title="Done!"
+            title="Done!",
+            description=f"Read {count} new messages in {time.perf_counter() - start:.1f}s."
         ))
 
-    @commands.command(name="dump", description="Dump all messages!")
-    async def dump(self, context: commands.Context) -> None:
-        """Dump the data"""
-
+    @analyze.command(name="backfill", description="Scrape the full history of every channel in the background!")
+    @commands.has_permissions(manage_guild=True)
+    async def backfill(self, context: commands.Context) -> None:
+        if self.scraper.start_backfill(context.guild):
+            description = "Reading the full history in the background, it will resume after a restart."
+        else:
+            description = "A backfill is already running for this server."
         await context.send(embed=discord.Embed(
-            title="Dumping messages!"
+            title="Backfilling messages!",
+            description=description
         ))
 
-        messages = await self.bot.database.get_msgs(context.guild.id)
-        user_cache = {}
-        guild_cache = {}
-
-        async def get_user_name(user_id):
-            if user_id not in user_cache:
-                user = await self.bot.fetch_user(user_id)
-                user_cache[user_id] = user.name
-            return user_cache[user_id]
-
-        async def get_server_name(guild_id):
-            if guild_id not in guild_cache:
-                guild = await self.bot.fetch_guild(guild_id)
-                guild_cache[guild_id] = guild
-            return guild_cache[guild_id]
-
-        message_chunks = []
-        current_chunk = ""
-
-        for message in messages:
-            message_content = f"{await get_user_name(message[0])} ({await get_server_name(message[1])}): {message[2]}\n"
-            if len(current_chunk) + len(message_content) > 4096:
-                message_chunks.append(current_chunk)
-                current_chunk = message_content
+    @commands.command(name="capture", description="Log new messages live, for the whole server or a single channel!")
+    @commands.has_permissions(manage_guild=True)
+    async def capture(self, context: commands.Context, state: str | None = None, channel: discord.TextChannel | None = None) -> None:
+        """
+        Turns live capture on or off, or shows where it is enabled.
+
+        :param state: Either `on` or `off`, leave empty to show the current settings.
+        :param channel: The channel to change, the whole server is changed if left empty.
+        """
+        target = channel or context.guild
+        if state in ("on", "off"):
+            enabled = state == "on"
+            await self.bot.database.set_capture(context.guild.id, target.id, enabled)
+            if enabled:
+                self.bot.capture_targets.add(target.id)
             else:
-                current_chunk += message_content
+                self.bot.capture_targets.discard(target.id)
 
-        if current_chunk:
-            message_chunks.append(current_chunk)
+        if context.guild.id in self.bot.capture_targets:
+            description = "Capturing every channel in this server."
+        else:
+            channels = [c.mention for c in context.guild.text_channels if c.id in self.bot.capture_targets]
+            description = f"Capturing {', '.join(channels)}." if channels else "Live capture is off, use `!capture on [channel]`."
+        await context.send(embed=discord.Embed(
+            title="Live capture",
+            description=description
+        ))
+
+    @commands.command(name="dump", description="Export the logged messages as a compressed file!")
+    async def dump(self, context: commands.Context, *, flags: DumpFlags) -> None:
+        """
+        Exports the logged messages as gzip-compressed NDJSON or CSV.
+
+        :param flags: The filters, plus `until:` to end the range and `format:` (ndjson or csv).
+        """
+        await context.send(embed=discord.Embed(
+            title="Dumping messages!",
+            description=flags.describe() or None
+        ))
 
-        for chunk in message_chunks:
+        start = time.perf_counter()
+        # The margin covers the compressed bytes still buffered when a part is checked.
+        export = MessageExport(
+            f"messages-{context.guild.id}",
+            format=flags.format,
+            part_size=context.guild.filesize_limit - 1024 * 1024,
+        )
+        try:
+            batch = []
+            async for message in self.bot.database.iter_msgs(context.guild.id, **flags.filters()):
+                batch.append(message)
+                if len(batch) >= 5000:
+                    await self._export_batch(export, batch, context.guild)
+                    batch = []
+            if batch:
+                await self._export_batch(export, batch, context.guild)
+            parts = await export.close()
+
+            if not export.rows:
+                await context.send(embed=discord.Embed(
+                    description="No messages have been logged yet, try `!scrape` first.",
+                    color=0xE02B2B
+                ))
+                return
+            for filename, file in parts:
+                await context.send(file=discord.File(file, filename=filename))
             await context.send(embed=discord.Embed(
-                title="Messages",
-                description=chunk
+                title="Done!",
+                description=f"Exported {export.rows} messages in {len(parts)} file(s) in {time.perf_counter() - start:.1f}s."
             ))
+        finally:
+            export.discard()
+
+    async def _export_batch(self, export: MessageExport, batch: list[tuple], guild: discord.Guild) -> None:
+        user_names = await self.bot.names.users((message[2] for message in batch), guild)
+        channel_names = {}
+        for channel_id in {message[1] for message in batch}:
+            channel = guild.get_channel(channel_id)
+            channel_names[channel_id] = channel.name if channel is not None else ""
+        await export.write(batch, user_names, channel_names)
 
     @commands.command(name="frequency", description="Analyze the frequency of words in the channel!")
-    async def frequency(self, context: commands.Context) -> None:
+    async def frequency(self, context: commands.Context, *, flags: FrequencyFlags) -> None:
         await context.send(embed=discord.Embed(
-            title="Frequency Analysis"
+            title="Frequency Analysis",
+            description=flags.describe() or None
         ))
 
-        messages = await self.bot.database.get_msgs(context.guild.id)
-        all_text = " ".join([message[2] for message in messages])
-
-        nlp = spacy.load("en_core_web_sm")
-        doc = nlp(all_text)
-        words = [token.text for token in doc if token.is_alpha]
-        word_freq = Counter(words)
-
-        common_words = word_freq.most_common(10)
+        common_words = await self.bot.database.get_top_terms(
+            context.guild.id,
+            exclude=() if flags.stopwords else await self.nlp.stop_words(),
+            tokenizer=self.nlp.terms,
+            **flags.filters()
+        )
+        if not common_words:
+            await context.send(embed=discord.Embed(
+                description="No messages have been logged yet, try `!scrape` first.",
+                color=0xE02B2B
+            ))
+            return
         labels, values = zip(*common_words)
 
-        plt.figure(figsize=(10, 5))
-        plt.bar(labels, values)
-        plt.xlabel('Words')
-        plt.ylabel('Frequency')
-        plt.title('Top 10 Most Common Words')
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
+        png = await self.charts.bar(
+            labels,
+            values,
+            title='Top 10 Most Common Words',
+            xlabel='Words',
+            ylabel='Frequency'
+        )
 
-        file = discord.File(buf, filename="frequency.png")
+        file = discord.File(io.BytesIO(png), filename="frequency.png")
         embed = discord.Embed(title="Word Frequency Analysis")
         embed.set_image(url="attachment://frequency.png")
         await context.send(file=file, embed=embed)
 
     @commands.command(name="topUsers", description="Show most active users by message count")
-    async def top_users(self, context: commands.Context) -> None:
-        messages = await self.bot.database.get_msgs(context.guild.id)
-        counter = Counter(msg[0] for msg in messages)
-        top_10 = counter.most_common(10)
-        
-        result = []
-        for user_id, count in top_10:
-            user = await self.bot.fetch_user(user_id)
-            result.append(f"{user.name}: {count}")
-        
+    async def top_users(self, context: commands.Context, *, flags: HistoryFlags) -> None:
+        top_10 = await self.bot.database.get_top_users(context.guild.id, **flags.filters())
+
+        names = await self.bot.names.users((user_id for user_id, _ in top_10), context.guild)
+        result = [f"{names[user_id]}: {count}" for user_id, count in top_10]
+
         await context.send(embed=discord.Embed(
             title="Top 10 Active Users",
-            description="\n".join(result)
+            description="\n".join(result) or "No messages have been logged yet, try `!scrape` first."
         ))
 
 async def setup(bot) -> None:
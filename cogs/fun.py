@@ -6,6 +6,7 @@ Description:
 Version: 6.2.0
 """
 
+import asyncio
 import random
 
 import aiohttp
@@ -104,21 +105,19 @@ class Fun(commands.Cog, name="fun"):
 
         :param context: The hybrid command context.
         """
-        # This will prevent your bot from stopping everything when doing a web request - see: https://discordpy.readthedocs.io/en/stable/faq.html#how-do-i-make-a-web-request
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
+        # Every call should get a new fact, so the response is never cached.
+        try:
+            data = await self.bot.web.get_json(
                 "https://uselessfacts.jsph.pl/random.json?language=en"
-            ) as request:
-                if request.status == 200:
-                    data = await request.json()
-                    embed = discord.Embed(description=data["text"], color=0xD75BF4)
-                else:
-                    embed = discord.Embed(
-                        title="Error!",
-                        description="There is something wrong with the API, please try again later",
-                        color=0xE02B2B,
-                    )
-                await context.send(embed=embed)
+            )
+            embed = discord.Embed(description=data["text"], color=0xD75BF4)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            embed = discord.Embed(
+                title="Error!",
+                description="There is something wrong with the API, please try again later",
+                color=0xE02B2B,
+            )
+        await context.send(embed=embed)
 
     @commands.hybrid_command(
         name="coinflip", description="Make a coin flip, but give your bet before."
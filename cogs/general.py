@@ -6,6 +6,7 @@ Description:
 Version: 6.2.0
 """
 
+import asyncio
 import platform
 import random
 
@@ -181,6 +182,32 @@ class General(commands.Cog, name="general"):
         )
         await context.send(embed=embed)
 
+    @commands.hybrid_command(
+        name="stalls",
+        description="List the commands that blocked the bot for the longest.",
+    )
+    @commands.is_owner()
+    async def stalls(self, context: Context) -> None:
+        """
+        List the commands that blocked the bot for the longest.
+
+        :param context: The hybrid command context.
+        """
+        offenders = self.bot.watchdog.worst()
+        embed = discord.Embed(
+            title="Event loop stalls",
+            description=None if offenders else "The event loop has not been blocked yet.",
+            color=0xBEBEFE,
+        )
+        for offender in offenders:
+            location = offender.stack[-1].strip().splitlines()[0] if offender.stack else ""
+            embed.add_field(
+                name=offender.name,
+                value=f"worst {offender.worst * 1000:.0f}ms, {offender.count}x, {offender.total:.1f}s in total\n`{location[:900]}`",
+                inline=False,
+            )
+        await context.send(embed=embed)
+
     @commands.hybrid_command(
         name="invite",
         description="Get the invite link of the bot to be able to invite it.",
@@ -273,25 +300,23 @@ class General(commands.Cog, name="general"):
 
         :param context: The hybrid command context.
         """
-        # This will prevent your bot from stopping everything when doing a web request - see: https://discordpy.readthedocs.io/en/stable/faq.html#how-do-i-make-a-web-request
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                "https://api.coindesk.com/v1/bpi/currentprice/BTC.json"
-            ) as request:
-                if request.status == 200:
-                    data = await request.json()
-                    embed = discord.Embed(
-                        title="Bitcoin price",
-                        description=f"The current price is {data['bpi']['USD']['rate']} :dollar:",
-                        color=0xBEBEFE,
-                    )
-                else:
-                    embed = discord.Embed(
-                        title="Error!",
-                        description="There is something wrong with the API, please try again later",
-                        color=0xE02B2B,
-                    )
-                await context.send(embed=embed)
+        # The price is shared between invocations for a short while, so repeated calls skip the API.
+        try:
+            data = await self.bot.web.get_json(
+                "https://api.coindesk.com/v1/bpi/currentprice/BTC.json", ttl=30
+            )
+            embed = discord.Embed(
+                title="Bitcoin price",
+                description=f"The current price is {data['bpi']['USD']['rate']} :dollar:",
+                color=0xBEBEFE,
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            embed = discord.Embed(
+                title="Error!",
+                description="There is something wrong with the API, please try again later",
+                color=0xE02B2B,
+            )
+        await context.send(embed=embed)
 
     @app_commands.command(
         name="feedback", description="Submit a feedback for the owners of the bot"
@@ -1,17 +1,34 @@
 """Ollama Language Model, a wrapper for models running on the local machine."""
 
-from collections.abc import Collection, Sequence
+from collections import OrderedDict, deque
+from collections.abc import (
+    AsyncIterable, AsyncIterator, Awaitable, Callable, Collection, Iterable, Sequence
+)
+from datetime import datetime, timezone
+import asyncio
+import functools
+import hashlib
+import importlib
 import json
 import logging
-import ollama
+import re
+import time
 import discord
-from discord.ext import commands
-from collections import deque
+from discord.ext import commands, tasks
+
+from helpers.converters import HistoryFlags
+from helpers.metrics import LLM_LATENCY, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_RUNNING
 
 
 _MAX_MULTIPLE_CHOICE_ATTEMPTS = 10
 _DEFAULT_TEMPERATURE = 0.5
+_DEFAULT_MAX_TOKENS = 1024
+_DEFAULT_CONTEXT_WINDOW = 8192
 _DEFAULT_TERMINATORS = ()
+_DEFAULT_PARALLELISM = 4
+_DEFAULT_CONCURRENCY = 4
+_FORMAT_BATCH_SIZE = 1000
+_MAX_REDUCTION_LEVELS = 8
 _DEFAULT_SYSTEM_MESSAGE = (
     'Continue the user\'s sentences. Never repeat their starts. For example, '
     'when you see \'Bob is\', you should continue the sentence after '
@@ -23,18 +40,157 @@ _DEFAULT_SYSTEM_MESSAGE = (
     'most important thing is to always continue in the same style as the user.'
 )
 
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]|\n")
+
+
+def approximate_tokens(text: str) -> int:
+    """Estimates the number of tokens in `text` without a tokenizer.
+
+    Every punctuation mark and newline counts as a token and words count as one
+    token per four characters, which over-counts slightly for English chat so
+    that packed prompts stay inside the context window.
+    """
+    return sum(
+        (len(piece) + 3) // 4 if piece[0].isalnum() or piece[0] == "_" else 1
+        for piece in _TOKEN_PIECES.findall(text)
+    )
+
+
+async def _chain(*parts: Iterable[str] | AsyncIterable[str]) -> AsyncIterator[str]:
+    """Iterates over plain and async iterables, one after the other."""
+    for part in parts:
+        if isinstance(part, AsyncIterable):
+            async for item in part:
+                yield item
+        else:
+            for item in part:
+                yield item
+
+
+def request_key(model: str, system_message: str, prompt: str, options: dict) -> str:
+    """The hash identifying a request, equal requests always get the same response."""
+    return hashlib.sha256(
+        json.dumps([model, system_message, prompt, options], sort_keys=True).encode()
+    ).hexdigest()
+
+
+def load_tokenizer(path: str | None) -> Callable[[str], int]:
+    """Returns an exact token counter for a Hugging Face `tokenizer.json`.
+
+    Falls back to `approximate_tokens` when no path is given or the
+    `tokenizers` package is not installed.
+    """
+    if not path:
+        return approximate_tokens
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        logging.warning("The tokenizers package is not installed, approximating token counts.")
+        return approximate_tokens
+    tokenizer = Tokenizer.from_file(path)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+_SUMMARY_PROMPT = """
+            Summarise the following conversation in a concise manner. Summarise in a purely 
+            factual manner, without any opinions or conversation. Do not print out what you
+            are thinking.
+        """
+_TOPICS_PROMPT = """
+        Find the key topics in the following conversation. Additionally, find the relevant 
+        speakers of these topics. List these out side by side. Do this in a purely factual 
+        manner, without opinions or conversation. Do not print out what you are thinking.
+      """
+_BUCKET_PROMPT = """
+            Summarise the following conversation in a concise manner. Summarise in a purely
+            factual manner, without any opinions or conversation, and keep the names of who
+            said what. Do not print out what you are thinking.
+        """
+_HOUR = 60 * 60
+_DAY = _HOUR * 24
+
+
 class LLM(commands.Cog, name="llm"):
     def __init__(self, bot) -> None:
         self.bot = bot
+        self.count_tokens = load_tokenizer(bot.config.get("llm_tokenizer"))
+        self.cache = ResponseCache(
+            bot,
+            memory_size = bot.config.get("llm_cache_entries", 256),
+            max_size = bot.config.get("llm_cache_mb", 64) * 1024 * 1024,
+            ttl = bot.config.get("llm_cache_days", 30) * _DAY,
+        )
+        self.scheduler = LLMScheduler(
+            concurrency = bot.config.get("llm_concurrency", _DEFAULT_CONCURRENCY)
+        )
+        self.model = OllamaLanguageModel(
+            "gemma2:2b",
+            context_window = bot.config.get("llm_context_window", _DEFAULT_CONTEXT_WINDOW),
+            count_tokens = self.count_tokens,
+            cache = self.cache,
+            scheduler = self.scheduler,
+        )
+        self.summaries = SummaryStore(
+            bot,
+            self.model,
+            self.format_messages,
+            parallelism = bot.config.get("llm_parallelism", _DEFAULT_PARALLELISM),
+        )
+        self._running = 0
+
+    async def cog_load(self) -> None:
+        self.precompute_summaries.start()
+
+    async def cog_unload(self) -> None:
+        self.precompute_summaries.cancel()
+
+    @tasks.loop(minutes=5.0)
+    async def precompute_summaries(self) -> None:
+        """Summarises the hours and days that have ended while no command needs the model."""
+        try:
+            count = await self.summaries.precompute(is_idle = lambda: self._running == 0)
+        except Exception as e:
+            self.bot.logger.error(f"Failed to precompute summaries\n{type(e).__name__}: {e}")
+            return
+        if count:
+            self.bot.logger.info(f"Precomputed {count} summaries")
+
+    @precompute_summaries.before_loop
+    async def before_precompute_summaries(self) -> None:
+        await self.bot.wait_until_ready()
+        # Imports the Ollama client in the background, so the first command does not pay for it.
+        await asyncio.to_thread(importlib.import_module, "ollama")
+
+    async def format_messages(self, messages: list[tuple], server_id: int) -> list[str]:
+        """Formats rows of `DatabaseManager.iter_msgs` as lines of a prompt."""
+        guild = self.bot.get_guild(server_id)
+        guild_name = self.bot.names.guild(server_id)
+        names = await self.bot.names.users((message[2] for message in messages), guild)
+        return [f"{names[message[2]]} ({guild_name}): {message[3]}\n" for message in messages]
 
+    async def stream_messages(self, server_id: int, **filters) -> AsyncIterator[str]:
+        """Streams the logged messages of a guild as lines of a prompt.
+
+        Rows are formatted one batch at a time, so only a batch of messages
+        and its authors' names are ever held in memory, as in `!dump`.
+
+        Args:
+            filters: Passed on to `DatabaseManager.iter_msgs`.
+        """
+        batch = []
+        async for message in self.bot.database.iter_msgs(server_id, **filters):
+            batch.append(message)
+            if len(batch) >= _FORMAT_BATCH_SIZE:
+                for line in await self.format_messages(batch, server_id):
+                    yield line
+                batch = []
+        if batch:
+            for line in await self.format_messages(batch, server_id):
+                yield line
 
     @commands.command(name="summary", description="A summary of the goings in the server.")
-    async def summary(self, context: commands.Context) -> None:
-        return await self.query(context, """
-            Summarise the following conversation in a concise manner. Summarise in a purely 
-            factual manner, without any opinions or conversation. Do not print out what you
-            are thinking.
-        """)
+    async def summary(self, context: commands.Context, *, flags: HistoryFlags) -> None:
+        await self._run(context, _SUMMARY_PROMPT, flags, summarised = True)
 
     
     @commands.command(name="query", description="Base command with usage.")
@@ -43,51 +199,598 @@ class LLM(commands.Cog, name="llm"):
         await context.send("Usage: !query <your_question>")
 
     @commands.command(name="query", description="Queries the LLM with message history.")
-    async def query(self, context: commands.Context, query: str) -> None:
+    async def query(self, context: commands.Context, query: str, *, flags: HistoryFlags) -> None:
         """Queries the LLM with message history."""
+        await self._run(context, query, flags)
+        
+    @commands.command(name="topics", description="The topics and their relevant parties.")
+    async def topics(self, context: commands.Context, *, flags: HistoryFlags) -> None:
+        await self._run(context, _TOPICS_PROMPT, flags, summarised = True)
+
+    @commands.command(name="llmcache", description="Show the hit rate of the LLM response cache.")
+    @commands.is_owner()
+    async def llmcache(self, context: commands.Context) -> None:
+        """Shows the hit rate of the LLM response cache."""
+        stats = self.cache.stats()
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"]
         await context.send(embed=discord.Embed(
-            title="Running LLM!"
+            title="LLM response cache",
+            description="\n".join(f"{name}: {value}" for name, value in stats.items())
+            + f"\nhit rate: {hits / lookups:.0%}" if lookups else "No lookups yet.",
+            color=0xBEBEFE
         ))
 
-        messages = await self.bot.database.get_msgs(context.guild.id)
+    async def _run(
+        self,
+        context: commands.Context,
+        command: str,
+        flags: HistoryFlags,
+        *,
+        summarised: bool = False,
+    ) -> None:
+        """Answers `command` about the history selected by `flags`.
 
-        user_cache = {}
-        guild_cache = {}
+        Args:
+            summarised: Work from the stored hour and day summaries instead of
+                the raw messages. They are not kept per user, so the raw messages
+                are used anyway when a user is given.
+        """
+        reply = StreamingReply(await context.send(embed=discord.Embed(
+            title="Running LLM!",
+            description=flags.describe() or None
+        )))
 
-        async def get_user_name(user_id):
-            if user_id not in user_cache:
-                user = await self.bot.fetch_user(user_id)
-                user_cache[user_id] = user.name
-            return user_cache[user_id]
+        job = self.scheduler.job(
+            context.guild.id,
+            on_position = lambda ahead: reply.update(
+                f"Waiting for the model, {ahead} request(s) ahead in the queue."
+            ),
+        )
+        self._running += 1
+        try:
+            filters = flags.filters()
+            if summarised and flags.user is None:
+                await self.summaries.refresh(
+                    context.guild.id,
+                    since = filters["since"],
+                    channel_id = filters["channel_id"],
+                    job = job,
+                    on_progress = lambda done, total: reply.update(
+                        f"Summarising new messages: {done}/{total} hours and days done."
+                    ),
+                )
+                texts = await self.summaries.collect(
+                    context.guild.id,
+                    since = filters["since"],
+                    channel_id = filters["channel_id"],
+                )
+            else:
+                lines = self.stream_messages(context.guild.id, **filters)
+                first = await anext(lines, None)
+                texts = _chain((first,), lines) if first is not None else []
+            if not texts:
+                await context.send(embed=discord.Embed(
+                    description="No messages have been logged yet, try `!scrape` first.",
+                    color=0xE02B2B
+                ))
+                return
 
-        async def get_server_name(guild_id):
-            if guild_id not in guild_cache:
-                guild = await self.bot.fetch_guild(guild_id)
-                guild_cache[guild_id] = guild.name
-            return guild_cache[guild_id]
-        
-        # llm = OllamaLanguageModel("gemma2:2b")
-        llm = OllamaLanguageModel("gemma2:2b")
-        message_queue = deque([
-            f"{await get_user_name(message[0])} ({await get_server_name(message[1])}): {message[2]}\n"
-            for message in messages
-        ])
-        response = llm.reduce_text(
-            command = query,
-            text = message_queue,
+            response = await self.model.reduce_text(
+                command = command,
+                text = texts,
+                job = job,
+                parallelism = self.bot.config.get("llm_parallelism", _DEFAULT_PARALLELISM),
+                on_text = reply.update,
+                on_progress = lambda level, done, total: reply.update(
+                    f"Summarising, level {level}: {done}/{total} chunks done."
+                ),
+            )
+            await reply.finish(response)
+        finally:
+            self._running -= 1
+
+
+class SummaryStore:
+    """Summaries of every channel per hour and per day, kept in the database.
+
+    Only the buckets that received new, edited or deleted messages since they
+    were last summarised are sent to the model again. Day summaries are made
+    from the hour summaries of that day, and a window is answered from day
+    summaries for the whole days it covers and hour summaries for the rest.
+    """
+
+    def __init__(
+        self,
+        bot,
+        model: "OllamaLanguageModel",
+        format_messages: Callable[[list[tuple], int], Awaitable[list[str]]],
+        *,
+        parallelism: int = _DEFAULT_PARALLELISM,
+    ) -> None:
+        """Initializes the instance.
+
+        Args:
+            bot: The bot whose database holds the logs and the summaries.
+            model: The model the buckets are summarised with.
+            format_messages: Formats logged messages of a guild as lines of a prompt.
+            parallelism: Maximum number of buckets summarised at the same time.
+        """
+        self._bot = bot
+        self._model = model
+        self._format_messages = format_messages
+        self._semaphore = asyncio.Semaphore(parallelism)
+        self._parallelism = parallelism
+
+    async def refresh(
+        self,
+        server_id: int,
+        *,
+        since: int | None = None,
+        channel_id: int | None = None,
+        job: "LLMJob | None" = None,
+        on_progress: Callable[[int, int], None] | None = None,
+    ) -> int:
+        """Summarises the dirty buckets a `collect` with the same window would read.
+
+        Args:
+            job: The job the model calls are queued under, see `LLMScheduler`.
+
+        Returns:
+            The number of buckets that were summarised.
+        """
+        database = self._bot.database
+        first_day, today = self._days(since)
+        hours = await database.get_dirty_buckets(
+            0,
+            server_id = server_id,
+            channel_id = channel_id,
+            since = since // _HOUR if since is not None else None,
         )
+        days = await database.get_dirty_buckets(
+            1, server_id = server_id, channel_id = channel_id, since = first_day, before = today
+        )
+        total = len(hours) + len(days)
+        done = 0
+
+        def progress() -> None:
+            nonlocal done
+            done += 1
+            if on_progress is not None:
+                on_progress(done, total)
+
+        # Day summaries are built from hour summaries, so the hours go first.
+        await self._summarise(0, hours, progress, job)
+        await self._summarise(1, days, progress, job)
+        return total
+
+    async def collect(
+        self, server_id: int, *, since: int | None = None, channel_id: int | None = None
+    ) -> list[str]:
+        """Returns the stored summaries covering a window, oldest first, as prompt lines."""
+        database = self._bot.database
+        first_day, today = self._days(since)
+        since_hour = since // _HOUR if since is not None else None
+
+        if first_day < today:
+            hours_before = await database.get_summaries(
+                0, server_id, channel_id = channel_id, since = since_hour, before = first_day * 24
+            ) if since_hour is not None else []
+            days = await database.get_summaries(
+                1, server_id, channel_id = channel_id, since = first_day, before = today
+            )
+            hours_after = await database.get_summaries(
+                0, server_id, channel_id = channel_id, since = today * 24
+            )
+        else:
+            hours_before, days, hours_after = [], [], await database.get_summaries(
+                0, server_id, channel_id = channel_id, since = since_hour
+            )
+
+        return (
+            [self._format_summary(row, _HOUR, "%Y-%m-%d %H:00") for row in hours_before]
+            + [self._format_summary(row, _DAY, "%Y-%m-%d") for row in days]
+            + [self._format_summary(row, _HOUR, "%Y-%m-%d %H:00") for row in hours_after]
+        )
+
+    async def precompute(self, *, is_idle: Callable[[], bool]) -> int:
+        """Summarises the dirty buckets of hours and days that have ended, newest first.
+
+        Args:
+            is_idle: Checked between batches, precomputing stops as soon as it
+                returns `False`.
+
+        Returns:
+            The number of buckets that were summarised.
+        """
+        database = self._bot.database
+        count = 0
+        while is_idle():
+            now = int(time.time())
+            buckets = await database.get_dirty_buckets(
+                0, before = now // _HOUR, limit = self._parallelism
+            )
+            level = 0
+            if not buckets:
+                buckets = await database.get_dirty_buckets(
+                    1, before = now // _DAY, limit = self._parallelism
+                )
+                level = 1
+            if not buckets:
+                break
+            await self._summarise(level, buckets)
+            count += len(buckets)
+        return count
+
+    async def _summarise(
+        self,
+        level: int,
+        buckets: list[tuple[int, int, int, int]],
+        on_done: Callable[[], None] | None = None,
+        job: "LLMJob | None" = None,
+    ) -> None:
+        async def summarise(server_id: int, channel_id: int, bucket: int, version: int) -> None:
+            async with self._semaphore:
+                summary = await self._summarise_bucket(level, server_id, channel_id, bucket, job)
+            await self._bot.database.save_summary(
+                level, server_id, channel_id, bucket, summary, version
+            )
+            if on_done is not None:
+                on_done()
+
+        await asyncio.gather(*(summarise(*bucket) for bucket in buckets))
+
+    async def _summarise_bucket(
+        self, level: int, server_id: int, channel_id: int, bucket: int, job: "LLMJob | None"
+    ) -> str | None:
+        database = self._bot.database
+        if level == 0:
+            texts = await self._format_messages(
+                [
+                    message
+                    async for message in database.iter_msgs(
+                        server_id,
+                        channel_id = channel_id,
+                        since = bucket * _HOUR,
+                        until = (bucket + 1) * _HOUR,
+                    )
+                ],
+                server_id,
+            )
+        else:
+            texts = [
+                summary + "\n"
+                for _, _, summary in await database.get_summaries(
+                    0, server_id, channel_id = channel_id, since = bucket * 24, before = (bucket + 1) * 24
+                )
+            ]
+
+        if not texts:
+            return None
+        if level == 1 and len(texts) == 1:
+            # A day with a single active hour is already summarised.
+            return texts[0].strip()
+        return (await self._model.reduce_text(
+            command = _BUCKET_PROMPT, text = texts, job = job, parallelism = 1
+        )).strip()
+
+    def _format_summary(self, row: tuple[int, int, str], size: int, date_format: str) -> str:
+        channel_id, bucket, summary = row
+        channel = self._bot.get_channel(channel_id)
+        name = f"#{channel.name}" if channel is not None else "#unknown"
+        when = datetime.fromtimestamp(bucket * size, timezone.utc).strftime(date_format)
+        return f"{name} {when}: {summary}\n"
+
+    @staticmethod
+    def _days(since: int | None) -> tuple[int, int]:
+        """The first whole day inside the window and today, as day numbers."""
+        first_day = -(-since // _DAY) if since is not None else 0
+        return first_day, int(time.time()) // _DAY
 
-        await context.send(embed = discord.Embed(
-            description = response
-        ))
-        
-    @commands.command(name="topics", description="The topics and their relevant parties.")
-    async def topics(self, context: commands.Context) -> None:
-              return await self.query(context, """
-        Find the key topics in the following conversation. Additionally, find the relevant 
-        speakers of these topics. List these out side by side. Do this in a purely factual 
-        manner, without opinions or conversation. Do not print out what you are thinking.
-      """)
+
+class ResponseCache:
+    """Caches model responses by the hash of everything that affects them.
+
+    Recent responses are kept in an in-memory LRU, and every response is also
+    written to the `llm_cache` table so that it survives restarts, subject to a
+    time to live and a total size limit.
+    """
+
+    def __init__(
+        self,
+        bot,
+        *,
+        memory_size: int = 256,
+        max_size: int = 64 * 1024 * 1024,
+        ttl: float = 30 * _DAY,
+    ) -> None:
+        """Initializes the instance.
+
+        Args:
+            bot: The bot whose database holds the persistent tier.
+            memory_size: Number of responses kept in memory.
+            max_size: Total size of the persistent tier, in bytes.
+            ttl: Number of seconds a response stays valid.
+        """
+        self._bot = bot
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._memory_size = memory_size
+        self._max_size = max_size
+        self._ttl = ttl
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> str | None:
+        """Returns the cached response for `key`, or `None` on a miss."""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None and entry[0] >= now - self._ttl:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return entry[1]
+
+        response = await self._bot.database.get_cached_response(
+            key, since = int(now - self._ttl)
+        )
+        if response is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._remember(key, response)
+        return response
+
+    async def put(self, key: str, response: str) -> None:
+        """Caches `response` under `key` in both tiers."""
+        self._remember(key, response)
+        await self._bot.database.add_cached_response(
+            key, response, max_size = self._max_size, since = int(time.time() - self._ttl)
+        )
+
+    def stats(self) -> dict[str, int]:
+        """Hit and miss counters since the bot started."""
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self._memory),
+        }
+
+    def _remember(self, key: str, response: str) -> None:
+        self._memory[key] = (time.time(), response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_size:
+            self._memory.popitem(last=False)
+
+
+class LLMJob:
+    """A command's share of the model, its calls queue together in `LLMScheduler`."""
+
+    def __init__(
+        self, guild_id: int | None, on_position: Callable[[int], None] | None = None
+    ) -> None:
+        """Initializes the instance.
+
+        Args:
+            guild_id: The guild the calls are made for, `None` for background work.
+            on_position: Called with the number of calls ahead of this job's next
+                one every time that number changes while it is waiting.
+        """
+        self.guild_id = guild_id
+        self.on_position = on_position
+        self.position: int | None = None
+
+
+class LLMScheduler:
+    """Shares the model fairly between guilds and the commands running in them.
+
+    At most `concurrency` calls run at once. Waiting calls are queued per guild
+    and per job, and the next call is taken round-robin from the guilds and then
+    from the jobs within the guild, so a summary made of hundreds of calls only
+    ever takes one turn at a time and short queries are not stuck behind it.
+    Identical calls that are in flight at the same time run only once.
+    """
+
+    def __init__(self, *, concurrency: int = _DEFAULT_CONCURRENCY) -> None:
+        """Initializes the instance.
+
+        Args:
+            concurrency: Maximum number of calls sent to the model at once.
+        """
+        self.concurrency = concurrency
+        self.deduplicated = 0
+        self._running = 0
+        self._queues: OrderedDict[int | None, OrderedDict[LLMJob, deque[asyncio.Future]]] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._callers: dict[asyncio.Task, int] = {}
+
+    def job(
+        self, guild_id: int | None, *, on_position: Callable[[int], None] | None = None
+    ) -> LLMJob:
+        """Creates the job the calls of one command are queued under."""
+        return LLMJob(guild_id, on_position)
+
+    @property
+    def depth(self) -> int:
+        """Number of calls waiting for their turn."""
+        return sum(len(waiters) for jobs in self._queues.values() for waiters in jobs.values())
+
+    async def run(
+        self, job: LLMJob | None, key: str, generate: Callable[[], Awaitable[str]]
+    ) -> str:
+        """Runs `generate` once it is `job`'s turn, or joins an identical call.
+
+        Args:
+            job: The job the call belongs to, `None` for background work.
+            key: Identifies the call, see `request_key`.
+            generate: Makes the call.
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._call(job or LLMJob(None), generate))
+            # Nobody may be waiting on a failed call, which is not worth a warning.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self._in_flight[key] = task
+        else:
+            self.deduplicated += 1
+
+        # The call runs in its own task, so cancelling one caller does not cancel it for the
+        # others. It is only cancelled once every caller is gone.
+        self._callers[task] = self._callers.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._callers[task] -= 1
+            if not self._callers[task]:
+                del self._callers[task]
+                if not task.done():
+                    self._forget(key, task)
+                    task.cancel()
+
+    async def _call(self, job: LLMJob, generate: Callable[[], Awaitable[str]]) -> str:
+        await self._acquire(job)
+        try:
+            return await generate()
+        finally:
+            self._release()
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        # A call cancelled by its last caller is forgotten at once, so a new identical call
+        # starts over instead of joining the cancelled one.
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    async def _acquire(self, job: LLMJob) -> None:
+        if self._running < self.concurrency and not self._queues:
+            self._running += 1
+            LLM_RUNNING.set(self._running)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(job.guild_id, OrderedDict()).setdefault(job, deque()).append(waiter)
+        self._report()
+        try:
+            with LLM_QUEUE_WAIT.time():
+                await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The turn was handed over just before the cancellation.
+                self._release()
+            else:
+                self._remove(job, waiter)
+            raise
+
+    def _release(self) -> None:
+        self._running -= 1
+        while self._running < self.concurrency and self._queues:
+            guild_id, jobs = next(iter(self._queues.items()))
+            job, waiters = next(iter(jobs.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                jobs.move_to_end(job)
+            else:
+                del jobs[job]
+            if jobs:
+                self._queues.move_to_end(guild_id)
+            else:
+                del self._queues[guild_id]
+            if waiter.cancelled():
+                # Its task was cancelled but has not run yet to take it out of the queue.
+                continue
+            self._running += 1
+            waiter.set_result(None)
+        self._report()
+
+    def _remove(self, job: LLMJob, waiter: asyncio.Future) -> None:
+        jobs = self._queues.get(job.guild_id)
+        if jobs is None or job not in jobs or waiter not in jobs[job]:
+            # `_release` already dropped it.
+            return
+        jobs[job].remove(waiter)
+        if not jobs[job]:
+            del jobs[job]
+        if not jobs:
+            del self._queues[job.guild_id]
+        self._report()
+
+    def _report(self) -> None:
+        """Tells every waiting job how many calls will be taken before its next one."""
+        LLM_QUEUE_DEPTH.set(self.depth)
+        LLM_RUNNING.set(self._running)
+        # Replays the round-robin on the queue lengths until every job has had a turn.
+        guilds = deque(
+            deque([job, len(waiters)] for job, waiters in jobs.items())
+            for jobs in self._queues.values()
+        )
+        waiting = sum(len(jobs) for jobs in guilds)
+        positions: dict[LLMJob, int] = {}
+        ahead = 0
+        while len(positions) < waiting:
+            jobs = guilds.popleft()
+            entry = jobs.popleft()
+            positions.setdefault(entry[0], ahead)
+            ahead += 1
+            entry[1] -= 1
+            if entry[1]:
+                jobs.append(entry)
+            if jobs:
+                guilds.append(jobs)
+
+        for job, position in positions.items():
+            if job.position != position:
+                job.position = position
+                if job.on_position is not None:
+                    job.on_position(position)
+
+
+class StreamingReply:
+    """Edits a reply message with partial output, at most once per `interval` seconds."""
+
+    def __init__(self, message: discord.Message, *, interval: float = 1.0) -> None:
+        """Initializes the instance.
+
+        Args:
+            message: The message to edit.
+            interval: Minimum number of seconds between two edits, which keeps the
+                bot well within Discord's rate limits.
+        """
+        self._message = message
+        self._interval = interval
+        self._text = ""
+        self._last_edit = 0.0
+        self._edit: asyncio.Task | None = None
+
+    def update(self, text: str) -> None:
+        """Shows `text` as soon as the throttle allows, never blocks the caller."""
+        self._text = text
+        if self._edit is not None and not self._edit.done():
+            return
+        delay = max(0.0, self._last_edit + self._interval - time.monotonic())
+        self._edit = asyncio.create_task(self._flush(delay))
+
+    async def finish(self, text: str) -> None:
+        """Waits for any pending edit, then shows the final `text`."""
+        if self._edit is not None:
+            self._edit.cancel()
+            try:
+                await self._edit
+            except asyncio.CancelledError:
+                pass
+        await self._show(text)
+
+    async def _flush(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self._show(self._text + " ▌")
+
+    async def _show(self, text: str) -> None:
+        self._last_edit = time.monotonic()
+        if len(text) > 4096:
+            text = text[:4095] + "…"
+        try:
+            await self._message.edit(embed=discord.Embed(description=text))
+        except discord.HTTPException as e:
+            logging.warning(f"Failed to update the reply: {e}")
 
 
 class OllamaLanguageModel:
@@ -98,6 +801,10 @@ class OllamaLanguageModel:
         model_name: str,
         *,
         system_message: str = _DEFAULT_SYSTEM_MESSAGE,
+        context_window: int = _DEFAULT_CONTEXT_WINDOW,
+        count_tokens: Callable[[str], int] = approximate_tokens,
+        cache: ResponseCache | None = None,
+        scheduler: LLMScheduler | None = None,
     ) -> None:
         """Initializes the instance.
 
@@ -106,28 +813,46 @@ class OllamaLanguageModel:
                 https://github.com/ollama/ollama.
             system_message: System message to prefix to requests when prompting the
                 model.
-            measurements: The measurements object to log usage statistics to.
-            channel: The channel to write the statistics to.
+            context_window: Number of tokens the model can attend to, prompt and
+                output together. It is passed on to Ollama as `num_ctx`.
+            count_tokens: Counts the tokens of a string, see `load_tokenizer`.
+            cache: Where responses are looked up before calling the model.
+            scheduler: Decides when each call is sent, calls are sent right away
+                without one.
         """
         self._model_name = model_name
-        self._client = ollama.Client()
+        self._client = None
         self._system_message = system_message
+        self._context_window = context_window
+        self._count_tokens = count_tokens
+        self._cache = cache
+        self._scheduler = scheduler
         self._terminators = []
 
         logging.basicConfig(level = logging.INFO, format = "[%(levelname)s] %(asctime)s :: %(message)s")
         logging.info("Setup")
 
-    def sample_text(
+    async def sample_text(
         self,
         prompt: str,
         *,
-        max_tokens: int = 4096,
+        max_tokens: int = _DEFAULT_MAX_TOKENS,
         terminators: Collection[str] = _DEFAULT_TERMINATORS,
         temperature: float = _DEFAULT_TEMPERATURE,
         timeout: float = -1,
         seed: int | None = None,
+        job: LLMJob | None = None,
+        on_text: Callable[[str], None] | None = None,
     ) -> str:
-        del max_tokens, timeout, seed, temperature  # Unused.
+        """Generates a continuation of `prompt`, streaming it as it is produced.
+
+        Args:
+            max_tokens: Maximum number of tokens to generate.
+            job: The job the call is queued under, see `LLMScheduler`.
+            on_text: Called with the text generated so far every time new tokens
+                arrive. It must not block.
+        """
+        del timeout, seed, temperature  # Unused.
 
         logging.info(f"Sent prompt, {len(prompt)} characters, beginning: \"{prompt[:32]}\".")
 
@@ -135,49 +860,234 @@ class OllamaLanguageModel:
 
         terminators = self._terminators + list(terminators)
 
-        response = self._client.generate(
-            model=self._model_name,
-            prompt=prompt_with_system_message,
-            options={'stop': terminators},
-            keep_alive='10m',
-        )
-        result = response['response']
+        options = {
+            'stop': terminators,
+            'num_ctx': self._context_window,
+            'num_predict': max_tokens,
+        }
+        key = request_key(self._model_name, self._system_message, prompt, options)
+        if self._cache is not None:
+            start = time.perf_counter()
+            result = await self._cache.get(key)
+            if result is not None:
+                LLM_LATENCY.observe(
+                    time.perf_counter() - start, model = self._model_name, outcome = "cached"
+                )
+                logging.info(f"-> Cached response, {len(result)} characters, beginning: \"{result[:32]}\".")
+                if on_text is not None:
+                    on_text(result)
+                return result
+
+        streamed = False
+
+        async def generate() -> str:
+            nonlocal streamed
+            streamed = True
+            result = ""
+            start = time.perf_counter()
+            try:
+                async for part in await self.client.generate(
+                    model=self._model_name,
+                    prompt=prompt_with_system_message,
+                    options=options,
+                    keep_alive='10m',
+                    stream=True,
+                ):
+                    result += part['response']
+                    if on_text is not None and part['response']:
+                        on_text(result)
+            except Exception:
+                LLM_LATENCY.observe(
+                    time.perf_counter() - start, model = self._model_name, outcome = "failed"
+                )
+                raise
+            LLM_LATENCY.observe(
+                time.perf_counter() - start, model = self._model_name, outcome = "generated"
+            )
+
+            if self._cache is not None:
+                await self._cache.put(key, result)
+            logging.info(f"-> Generated response, {len(result)} characters, beginning: \"{result[:32]}\".")
+            return result
 
-        logging.info(f"-> Generated response, {len(result)} characters, beginning: \"{result[:32]}\".")
+        if self._scheduler is None:
+            return await generate()
+        result = await self._scheduler.run(job, key, generate)
+        if not streamed and on_text is not None:
+            # An identical call was already running and produced the text.
+            on_text(result)
         return result
 
-    def reduce_text(
+    @property
+    def client(self) -> "ollama.AsyncClient":
+        """The Ollama client, created on first use so the bot starts without importing it."""
+        if self._client is None:
+            import ollama
+
+            self._client = ollama.AsyncClient()
+        return self._client
+
+    async def reduce_text(
         self,
         command: str,
-        text: deque[str],
+        text: Iterable[str] | AsyncIterable[str],
         *,
-        max_tokens: int = 4096,
+        max_tokens: int = _DEFAULT_MAX_TOKENS,
         terminators: Collection[str] = _DEFAULT_TERMINATORS,
         temperature: float = _DEFAULT_TEMPERATURE,
         timeout: float = -1,
         seed: int | None = None,
+        job: LLMJob | None = None,
+        parallelism: int = _DEFAULT_PARALLELISM,
+        on_text: Callable[[str], None] | None = None,
+        on_progress: Callable[[int, int, int], None] | None = None,
     ) -> str:
+        """Reduces `text` to a single answer to `command` by tree reduction.
+
+        The messages are packed into chunks that fit the budget, every chunk is
+        sampled concurrently and the responses become the input of the next
+        level, until everything fits into one final prompt. The first level is
+        packed while it is sampled, so streamed messages are never all in memory.
+
+        Args:
+            command: The instruction prefixed to every prompt.
+            text: The messages to reduce, in order, possibly streamed.
+            max_tokens: Maximum number of tokens generated per call, this much of
+                the context window is kept free for the output.
+            job: The job the calls are queued under, see `LLMScheduler`.
+            parallelism: Maximum number of concurrent requests to the model.
+            on_text: Receives the streamed text of the final answer only.
+            on_progress: Called with `(level, done, total)` every time a chunk of
+                a level has been sampled. While a level is still being packed,
+                `total` counts the chunks packed so far.
+        """
+        budget = self.prompt_budget(command, max_tokens = max_tokens)
+        sample = functools.partial(
+            self.sample_text,
+            max_tokens = max_tokens,
+            terminators = terminators,
+            temperature = temperature,
+            timeout = timeout,
+            seed = seed,
+            job = job,
+        )
+
+        chunks = self._pack(text, budget)
+        level = 0
+        while True:
+            first = await anext(chunks, None)
+            second = await anext(chunks, None)
+            if second is None:
+                final = first or ""
+                break
+            if level == _MAX_REDUCTION_LEVELS:
+                # Responses that never converged are cut down to fit the final prompt.
+                final = first + second + "".join([chunk async for chunk in chunks])
+                break
+            level += 1
+            responses = await self._reduce_level(
+                _chain((first, second), chunks),
+                lambda chunk: sample(command + chunk),
+                level = level,
+                parallelism = parallelism,
+                on_progress = on_progress,
+            )
+            chunks = self._pack(responses, budget)
+
+        final = self._truncate(final, budget)
+        return await sample(command + final, on_text = on_text)
+
+    async def _reduce_level(
+        self,
+        chunks: AsyncIterator[str],
+        reduce: Callable[[str], Awaitable[str]],
+        *,
+        level: int,
+        parallelism: int,
+        on_progress: Callable[[int, int, int], None] | None,
+    ) -> list[str]:
+        """Reduces every chunk of one level, in order.
+
+        The next chunk is only packed once one of the `parallelism` running
+        reductions has finished, so a level read from the database never holds
+        more than a few chunks of text at once.
+        """
+        semaphore = asyncio.Semaphore(parallelism)
+        tasks: list[asyncio.Task] = []
+        done = 0
+
+        async def reduce_chunk(chunk: str) -> str:
+            nonlocal done
+            try:
+                response = await reduce(chunk)
+            finally:
+                semaphore.release()
+            done += 1
+            if on_progress is not None:
+                on_progress(level, done, len(tasks))
+            return response
+
+        try:
+            async for chunk in chunks:
+                await semaphore.acquire()
+                for task in tasks:
+                    if task.done() and task.exception() is not None:
+                        raise task.exception()
+                tasks.append(asyncio.create_task(reduce_chunk(chunk)))
+            return list(await asyncio.gather(*tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def prompt_budget(self, command: str, *, max_tokens: int = _DEFAULT_MAX_TOKENS) -> int:
+        """Number of tokens left for text in a prompt made of `command`.
+
+        The system message, the command and `max_tokens` of output are reserved
+        out of the context window, along with a small margin for the separators
+        and for estimation error.
+        """
+        reserved = (
+            self._count_tokens(self._system_message)
+            + self._count_tokens(command)
+            + max_tokens
+        )
+        margin = self._context_window // 32
+        return max(1, self._context_window - reserved - margin)
+
+    async def _pack(
+        self, text: Iterable[str] | AsyncIterable[str], budget: int
+    ) -> AsyncIterator[str]:
+        """Greedily packs messages, in order, into chunks of at most `budget` tokens.
+
+        Always yields at least one chunk, which is empty when there is no text.
+        """
+        if not isinstance(text, AsyncIterable):
+            text = _chain(text)
         chunk = ""
-        command_length = len(command)
-
-        while len(text) > 1:
-            message = text.popleft()
-            if len(chunk) + len(message) > max_tokens - command_length:
-                response = self.sample_text(
-                    command + chunk, 
-                    max_tokens = max_tokens,
-                    terminators = terminators, 
-                    temperature = temperature,
-                    timeout = timeout,
-                    seed = seed,
-                )
-                text.append(response)
-                chunk = message
+        chunk_tokens = 0
+        packed = False
+        async for message in text:
+            tokens = self._count_tokens(message)
+            if tokens > budget:
+                message = self._truncate(message, budget)
+                tokens = budget
+            if chunk and chunk_tokens + tokens > budget:
+                yield chunk
+                packed = True
+                chunk, chunk_tokens = message, tokens
             else:
                 chunk += message
-        
-        assert len(text) == 1
-        return text.pop()
+                chunk_tokens += tokens
+        if chunk or not packed:
+            yield chunk
+
+    def _truncate(self, text: str, budget: int) -> str:
+        """Cuts `text` down to at most `budget` tokens."""
+        tokens = self._count_tokens(text)
+        while tokens > budget:
+            text = text[: int(len(text) * budget / tokens * 0.95)]
+            tokens = self._count_tokens(text)
+        return text
 
 
 async def setup(bot) -> None:
@@ -6,7 +6,9 @@ Description:
 Version: 6.2.0
 """
 
-import os
+import asyncio
+import gzip
+import tempfile
 from datetime import datetime
 
 import discord
@@ -228,35 +230,92 @@ class Moderation(commands.Cog, name="moderation"):
     @commands.has_permissions(manage_messages=True)
     @app_commands.describe(
         limit="The limit of messages that should be archived.",
+        compress="Whether the archive should be compressed with gzip.",
     )
-    async def archive(self, context: Context, limit: int = 10) -> None:
+    async def archive(
+        self,
+        context: Context,
+        limit: commands.Range[int, 1, 100000] = 10,
+        compress: bool = False,
+    ) -> None:
         """
         Archives in a text file the last messages with a chosen limit of messages. This command requires the MESSAGE_CONTENT intent to work properly.
 
         :param limit: The limit of messages that should be archived. Default is 10.
+        :param compress: Whether the archive should be compressed with gzip. Default is False.
         """
-        log_file = f"{context.channel.id}.log"
-        with open(log_file, "w", encoding="UTF-8") as f:
-            f.write(
+        # The archive never touches a shared path, it stays in memory until it grows past a
+        # few megabytes and is then moved to an anonymous temporary file.
+        buffer = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        output = (
+            gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=6)
+            if compress
+            else buffer
+        )
+        try:
+            lines = [
                 f'Archived messages from: #{context.channel} ({context.channel.id}) in the guild "{context.guild}" ({context.guild.id}) at {datetime.now().strftime("%d.%m.%Y %H:%M:%S")}\n'
-            )
+            ]
             async for message in context.channel.history(
                 limit=limit, before=context.message
             ):
-                attachments = []
-                for attachment in message.attachments:
-                    attachments.append(attachment.url)
-                attachments_text = (
-                    f"[Attached File{'s' if len(attachments) >= 2 else ''}: {', '.join(attachments)}]"
-                    if len(attachments) >= 1
-                    else ""
-                )
-                f.write(
-                    f"{message.created_at.strftime('%d.%m.%Y %H:%M:%S')} {message.author} {message.id}: {message.clean_content} {attachments_text}\n"
+                lines.append(self.format_archived_message(message))
+                if len(lines) >= 1000:
+                    # Joining, encoding and compressing happen off the event loop.
+                    await asyncio.to_thread(self.write_archived_lines, output, lines)
+                    lines = []
+            await asyncio.to_thread(self.write_archived_lines, output, lines)
+            if compress:
+                await asyncio.to_thread(output.close)
+
+            size = buffer.tell()
+            if context.guild is not None and size > context.guild.filesize_limit:
+                embed = discord.Embed(
+                    description=f"The archive is {size / 1024 / 1024:.1f} MB, which is over the upload limit of this server. Try a smaller limit{'' if compress else ' or compress it'}.",
+                    color=0xE02B2B,
                 )
-        f = discord.File(log_file)
-        await context.send(file=f)
-        os.remove(log_file)
+                await context.send(embed=embed)
+                return
+            buffer.seek(0)
+            filename = f"{context.channel.id}.log{'.gz' if compress else ''}"
+            await context.send(file=discord.File(buffer, filename=filename))
+        finally:
+            buffer.close()
+
+    @staticmethod
+    def format_archived_message(message: discord.Message) -> str:
+        """
+        Formats a message as a line of an archive.
+
+        :param message: The message that should be formatted.
+        :return: The line, including the trailing newline.
+        """
+        line = f"{message.created_at.strftime('%d.%m.%Y %H:%M:%S')} {message.author} {message.id}: {message.clean_content}"
+        if message.reference is not None and message.reference.message_id is not None:
+            replied = message.reference.resolved
+            author = (
+                f" by {replied.author}"
+                if isinstance(replied, discord.Message)
+                else ""
+            )
+            line += f" [Reply to {message.reference.message_id}{author}]"
+        if message.attachments:
+            attachments = [
+                f"{attachment.filename} ({attachment.content_type or 'unknown type'}, {attachment.size} bytes) {attachment.url}"
+                for attachment in message.attachments
+            ]
+            line += f" [Attached File{'s' if len(attachments) >= 2 else ''}: {', '.join(attachments)}]"
+        return line + "\n"
+
+    @staticmethod
+    def write_archived_lines(output, lines: list[str]) -> None:
+        """
+        Writes lines of an archive, it blocks and should be run in a thread.
+
+        :param output: The file the archive is written to.
+        :param lines: The lines that should be written, including their trailing newlines.
+        """
+        output.write("".join(lines).encode())
 
 
 async def setup(bot) -> None:
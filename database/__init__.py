@@ -6,56 +6,107 @@ Description:
 Version: 6.2.0
 """
 
+import asyncio
+from collections import Counter
+from collections.abc import AsyncIterator, Collection, Iterable
+from itertools import groupby
+from operator import itemgetter
+
 import aiosqlite
 
+from database.buffer import MessageBuffer
+from database.terms import Tokenizer, tokenize_all
+from helpers.metrics import DATABASE_LATENCY
+
+# Statements that can be queued in a `MessageBuffer` and written together by `write_batch`.
+BATCH_STATEMENTS = {
+    "add": "INSERT OR IGNORE INTO logs(message_id, channel_id, server_id, user_id, message, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+    "edit": "UPDATE logs SET message=? WHERE message_id=?",
+    "delete": "DELETE FROM logs WHERE message_id=?",
+}
+
+
+def _timed(method):
+    """
+    Records how long every call of a query method took, see `helpers.metrics`.
+    """
+    return DATABASE_LATENCY.wrap(method, method=method.__name__)
+
 
 class DatabaseManager:
     def __init__(self, *, connection: aiosqlite.Connection) -> None:
         self.connection = connection
+        # Held while a multi-statement write is in progress, so another coroutine's commit or
+        # rollback on the shared connection can't cut it in half.
+        self.lock = asyncio.Lock()
 
+    @_timed
     async def add_msg(
-        self, user_id: int, server_id: int, message: str
+        self,
+        message_id: int,
+        channel_id: int,
+        server_id: int,
+        user_id: int,
+        message: str,
+        created_at: int,
     ) -> int:
         """
-        This function will add a warn to the database.
+        This function will add a single message to the logs.
 
-        :param user_id: The ID of the user that should be warned.
-        :param reason: The reason why the user should be warned.
+        :param message_id: The ID of the message.
+        :param channel_id: The ID of the channel the message was sent in.
+        :param server_id: The ID of the server the message was sent in.
+        :param user_id: The ID of the author of the message.
+        :param message: The content of the message.
+        :param created_at: When the message was sent, as a UNIX timestamp.
+        :return: The number of rows that were inserted.
         """
-        rows = await self.connection.execute(
-            "SELECT id FROM warns WHERE user_id=? AND server_id=? ORDER BY id DESC LIMIT 1",
-            (
-                user_id,
-                server_id,
-            ),
+        return await self.add_msgs(
+            [(message_id, channel_id, server_id, user_id, message, created_at)]
         )
-        async with rows as cursor:
-            result = await cursor.fetchone()
-            warn_id = result[0] + 1 if result is not None else 1
+
+    @_timed
+    async def add_msgs(self, rows: Iterable[tuple[int, int, int, int, str, int]]) -> int:
+        """
+        This function will add a batch of messages to the logs in a single transaction.
+
+        :param rows: The `(message_id, channel_id, server_id, user_id, message, created_at)` tuples that should be logged.
+        :return: The number of rows that were inserted, messages that are already logged are ignored.
+        """
+        return await self.write_batch([("add", row) for row in rows])
+
+    @_timed
+    async def write_batch(self, batch: list[tuple[str, tuple]]) -> int:
+        """
+        This function will apply a batch of queued writes, in order, in a single transaction.
+
+        :param batch: The `(kind, parameters)` pairs to apply, where `kind` is a key of `BATCH_STATEMENTS`.
+        :return: The number of rows that were changed.
+        """
+        changed = 0
+        async with self.lock:
             try:
-                await self.connection.execute(
-                    "INSERT INTO logs(user_id, server_id, message) VALUES (?, ?, ?)",
-                    (
-                        user_id,
-                        server_id,
-                        message
-                    ),
-                )
-            except aiosqlite.IntegrityError:
-                pass
+                for kind, group in groupby(batch, key=itemgetter(0)):
+                    cursor = await self.connection.executemany(
+                        BATCH_STATEMENTS[kind], [parameters for _, parameters in group]
+                    )
+                    changed += cursor.rowcount
+            except Exception:
+                await self.connection.rollback()
+                raise
             await self.connection.commit()
-            return warn_id
+        return changed
 
+    @_timed
     async def get_msgs(self, server_id: int) -> list:
         """
-        This function will get all the warnings of a user.
+        This function will get all the logged messages of a server, oldest first.
 
-        :param user_id: The ID of the user that should be checked.
         :param server_id: The ID of the server that should be checked.
-        :return: A list of all the warnings of the user.
+        :return: A list of `(user_id, server_id, message, created_at)` tuples.
         """
         rows = await self.connection.execute(
-            "SELECT user_id, server_id, message, strftime('%s', created_at) FROM logs WHERE server_id=?",
+            "SELECT user_id, server_id, message, created_at FROM logs WHERE server_id=? ORDER BY created_at",
             (
                 server_id,
             ),
@@ -66,3 +117,542 @@ class DatabaseManager:
             for row in result:
                 result_list.append(row)
             return result_list
+
+    async def iter_msgs(
+        self,
+        server_id: int,
+        *,
+        channel_id: int | None = None,
+        user_id: int | None = None,
+        since: int | None = None,
+        until: int | None = None,
+        limit: int | None = None,
+        chunk_size: int = 1000,
+    ) -> AsyncIterator[tuple]:
+        """
+        This function will stream the logged messages of a server, oldest first.
+
+        Rows are read in chunks using keyset pagination on `(created_at, message_id)`, so only one
+        chunk is ever held in memory and every chunk is an index range scan.
+
+        :param server_id: The ID of the server that should be checked.
+        :param channel_id: Only include messages sent in this channel.
+        :param user_id: Only include messages sent by this user.
+        :param since: Only include messages sent at or after this UNIX timestamp.
+        :param until: Only include messages sent before this UNIX timestamp.
+        :param limit: The maximum number of messages to return.
+        :param chunk_size: The number of rows read from the database at once.
+        :return: An async iterator of `(message_id, channel_id, user_id, message, created_at)` tuples.
+        """
+        conditions = ["server_id=?"]
+        parameters: list = [server_id]
+        for condition, value in (
+            ("channel_id=?", channel_id),
+            ("user_id=?", user_id),
+            ("created_at>=?", since),
+            ("created_at<?", until),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+
+        remaining = limit
+        cursor_key = None
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            where = conditions
+            if cursor_key is not None:
+                where = conditions + ["(created_at, message_id) > (?, ?)"]
+            # An async generator can't be wrapped by `_timed`, so every chunk is timed instead.
+            with DATABASE_LATENCY.time(method="iter_msgs"):
+                rows = await self.connection.execute(
+                    "SELECT message_id, channel_id, user_id, message, created_at FROM logs "
+                    f"WHERE {' AND '.join(where)} ORDER BY created_at, message_id LIMIT ?",
+                    (*parameters, *(cursor_key or ()), size),
+                )
+                async with rows as cursor:
+                    chunk = await cursor.fetchall()
+            for row in chunk:
+                yield row
+            if len(chunk) < size:
+                return
+            cursor_key = (chunk[-1][4], chunk[-1][0])
+            if remaining is not None:
+                remaining -= len(chunk)
+
+    @_timed
+    async def get_top_users(
+        self,
+        server_id: int,
+        *,
+        channel_id: int | None = None,
+        user_id: int | None = None,
+        since: int | None = None,
+        limit: int = 10,
+    ) -> list[tuple[int, int]]:
+        """
+        This function will get the users of a server that sent the most messages.
+
+        Whole days are read from the `message_counts` rollup, only the partial first day of the
+        window is counted from the logs themselves.
+
+        :param server_id: The ID of the server that should be checked.
+        :param channel_id: Only count messages sent in this channel.
+        :param user_id: Only count messages sent by this user.
+        :param since: Only count messages sent at or after this UNIX timestamp.
+        :param limit: The maximum number of users to return.
+        :return: A list of `(user_id, count)` tuples, most active first.
+        """
+        first_day = -(-since // 86400) if since is not None else 0
+        partial = (since, first_day * 86400) if since is not None else (0, 0)
+
+        filters = ""
+        parameters: list = []
+        for condition, value in (("channel_id=?", channel_id), ("user_id=?", user_id)):
+            if value is not None:
+                filters += f" AND {condition}"
+                parameters.append(value)
+
+        rows = await self.connection.execute(
+            f"""
+            SELECT user_id, SUM(count) AS total FROM (
+                SELECT user_id, count FROM message_counts
+                WHERE server_id=? AND day>=?{filters}
+                UNION ALL
+                SELECT user_id, COUNT(*) FROM logs
+                WHERE server_id=? AND created_at>=? AND created_at<?{filters}
+                GROUP BY user_id
+            )
+            GROUP BY user_id HAVING total > 0 ORDER BY total DESC LIMIT ?
+            """,
+            (server_id, first_day, *parameters, server_id, *partial, *parameters, limit),
+        )
+        async with rows as cursor:
+            return await cursor.fetchall()
+
+    @_timed
+    async def index_terms(
+        self, tokenizer: Tokenizer = tokenize_all, *, chunk_size: int = 2000
+    ) -> int:
+        """
+        This function will tokenize the messages queued by the `logs` triggers into the word-frequency index.
+
+        Each chunk is tokenized before the write lock is taken, so ingestion is never held up by
+        the tokenizer.
+
+        :param tokenizer: Turns a batch of messages into their words.
+        :param chunk_size: The number of queued messages handled per transaction.
+        :return: The number of queued messages that were indexed.
+        """
+        indexed = 0
+        while True:
+            rows = await self.connection.execute(
+                "SELECT rowid, server_id, channel_id, created_at, message, sign FROM term_queue ORDER BY rowid LIMIT ?",
+                (chunk_size,),
+            )
+            async with rows as cursor:
+                queued = await cursor.fetchall()
+            if not queued:
+                return indexed
+
+            counts = Counter()
+            terms = await tokenizer([row[4] for row in queued])
+            for (_, server_id, channel_id, created_at, _, sign), words in zip(queued, terms):
+                day = created_at // 86400
+                for term in words:
+                    counts[(server_id, day, channel_id, term)] += sign
+            async with self.lock:
+                try:
+                    await self.connection.executemany(
+                        """
+                        INSERT INTO term_counts(server_id, day, channel_id, term, count) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(server_id, day, channel_id, term) DO UPDATE SET count=count + excluded.count
+                        """,
+                        [(*key, count) for key, count in counts.items() if count],
+                    )
+                    await self.connection.execute(
+                        "DELETE FROM term_queue WHERE rowid<=?", (queued[-1][0],)
+                    )
+                except Exception:
+                    await self.connection.rollback()
+                    raise
+                await self.connection.commit()
+            indexed += len(queued)
+
+    @_timed
+    async def get_top_terms(
+        self,
+        server_id: int,
+        *,
+        channel_id: int | None = None,
+        user_id: int | None = None,
+        since: int | None = None,
+        limit: int = 10,
+        exclude: Collection[str] = (),
+        tokenizer: Tokenizer = tokenize_all,
+    ) -> list[tuple[str, int]]:
+        """
+        This function will get the most frequent words of a server.
+
+        Whole days are read from the `term_counts` index, only the partial first day of the window
+        is tokenized from the logs. The index is not kept per user, so filtering by user tokenizes
+        that user's messages instead.
+
+        :param server_id: The ID of the server that should be checked.
+        :param channel_id: Only count words in messages sent in this channel.
+        :param user_id: Only count words in messages sent by this user.
+        :param since: Only count words in messages sent at or after this UNIX timestamp.
+        :param limit: The maximum number of words to return.
+        :param exclude: Words that should not be counted, such as stop words.
+        :param tokenizer: Turns a batch of messages into their words, it should match the one the index is built with.
+        :return: A list of `(term, count)` tuples, most frequent first.
+        """
+        counts = Counter()
+
+        async def count_logs(**filters) -> None:
+            texts = []
+            async for message in self.iter_msgs(
+                server_id, channel_id=channel_id, user_id=user_id, **filters
+            ):
+                texts.append(message[3])
+                if len(texts) >= 1000:
+                    for words in await tokenizer(texts):
+                        counts.update(words)
+                    texts = []
+            for words in await tokenizer(texts):
+                counts.update(words)
+
+        if user_id is not None:
+            await count_logs(since=since)
+        else:
+            first_day = -(-since // 86400) if since is not None else 0
+            if since is not None:
+                await count_logs(since=since, until=first_day * 86400)
+            filters = " AND channel_id=?" if channel_id is not None else ""
+            parameters = [server_id, first_day]
+            if channel_id is not None:
+                parameters.append(channel_id)
+            # Words from the partial day need their whole-day counts too, so the limit only
+            # applies when there is no partial day to merge in.
+            limit_clause = ""
+            if not counts:
+                limit_clause = " LIMIT ?"
+                parameters.append(limit + len(exclude))
+            rows = await self.connection.execute(
+                f"""
+                SELECT term, SUM(count) AS total FROM term_counts
+                WHERE server_id=? AND day>=?{filters}
+                GROUP BY term HAVING total > 0 ORDER BY total DESC{limit_clause}
+                """,
+                parameters,
+            )
+            async with rows as cursor:
+                counts.update(dict(await cursor.fetchall()))
+
+        for term in exclude:
+            counts.pop(term, None)
+        return counts.most_common(limit)
+
+    @_timed
+    async def get_dirty_buckets(
+        self,
+        level: int,
+        *,
+        server_id: int | None = None,
+        channel_id: int | None = None,
+        since: int | None = None,
+        before: int | None = None,
+        limit: int | None = None,
+    ) -> list[tuple[int, int, int, int]]:
+        """
+        This function will get the summary buckets that received changes since they were last summarised, newest first.
+
+        :param level: The level of the buckets, 0 for hours and 1 for days.
+        :param server_id: Only include buckets of this server.
+        :param channel_id: Only include buckets of this channel.
+        :param since: Only include buckets at or after this bucket number.
+        :param before: Only include buckets before this bucket number.
+        :param limit: The maximum number of buckets to return.
+        :return: A list of `(server_id, channel_id, bucket, version)` tuples.
+        """
+        conditions = ["level=?"]
+        parameters: list = [level]
+        for condition, value in (
+            ("server_id=?", server_id),
+            ("channel_id=?", channel_id),
+            ("bucket>=?", since),
+            ("bucket<?", before),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        parameters.append(limit if limit is not None else -1)
+        rows = await self.connection.execute(
+            "SELECT server_id, channel_id, bucket, version FROM summary_dirty "
+            f"WHERE {' AND '.join(conditions)} ORDER BY bucket DESC LIMIT ?",
+            parameters,
+        )
+        async with rows as cursor:
+            return await cursor.fetchall()
+
+    @_timed
+    async def save_summary(
+        self,
+        level: int,
+        server_id: int,
+        channel_id: int,
+        bucket: int,
+        summary: str | None,
+        version: int,
+    ) -> None:
+        """
+        This function will store the summary of a bucket and mark it as clean, unless it changed again in the meantime.
+
+        :param level: The level of the bucket, 0 for hours and 1 for days.
+        :param server_id: The ID of the server the bucket belongs to.
+        :param channel_id: The ID of the channel the bucket belongs to.
+        :param bucket: The number of the hour or day since the UNIX epoch.
+        :param summary: The summary, or `None` if the bucket no longer has any messages.
+        :param version: The version of the bucket the summary was made from.
+        """
+        async with self.lock:
+            if summary is None:
+                await self.connection.execute(
+                    "DELETE FROM summaries WHERE level=? AND server_id=? AND bucket=? AND channel_id=?",
+                    (level, server_id, bucket, channel_id),
+                )
+            else:
+                await self.connection.execute(
+                    "INSERT OR REPLACE INTO summaries(level, server_id, bucket, channel_id, summary) VALUES (?, ?, ?, ?, ?)",
+                    (level, server_id, bucket, channel_id, summary),
+                )
+            await self.connection.execute(
+                "DELETE FROM summary_dirty WHERE level=? AND server_id=? AND bucket=? AND channel_id=? AND version=?",
+                (level, server_id, bucket, channel_id, version),
+            )
+            await self.connection.commit()
+
+    @_timed
+    async def get_summaries(
+        self,
+        level: int,
+        server_id: int,
+        *,
+        channel_id: int | None = None,
+        since: int | None = None,
+        before: int | None = None,
+    ) -> list[tuple[int, int, str]]:
+        """
+        This function will get the stored summaries of a server, oldest first.
+
+        :param level: The level of the summaries, 0 for hours and 1 for days.
+        :param server_id: The ID of the server that should be checked.
+        :param channel_id: Only include summaries of this channel.
+        :param since: Only include buckets at or after this bucket number.
+        :param before: Only include buckets before this bucket number.
+        :return: A list of `(channel_id, bucket, summary)` tuples.
+        """
+        conditions = ["level=?", "server_id=?"]
+        parameters: list = [level, server_id]
+        for condition, value in (
+            ("channel_id=?", channel_id),
+            ("bucket>=?", since),
+            ("bucket<?", before),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        rows = await self.connection.execute(
+            "SELECT channel_id, bucket, summary FROM summaries "
+            f"WHERE {' AND '.join(conditions)} ORDER BY bucket, channel_id",
+            parameters,
+        )
+        async with rows as cursor:
+            return await cursor.fetchall()
+
+    @_timed
+    async def get_cached_response(self, key: str, *, since: int) -> str | None:
+        """
+        This function will get a cached language model response and mark it as recently used.
+
+        :param key: The hash identifying the request.
+        :param since: Responses cached before this UNIX timestamp are considered expired.
+        :return: The response, or `None` if it is not cached.
+        """
+        rows = await self.connection.execute(
+            "SELECT response FROM llm_cache WHERE key=? AND created_at>=?", (key, since)
+        )
+        async with rows as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        async with self.lock:
+            await self.connection.execute(
+                "UPDATE llm_cache SET accessed_at=strftime('%s', 'now') WHERE key=?", (key,)
+            )
+            await self.connection.commit()
+        return row[0]
+
+    @_timed
+    async def add_cached_response(
+        self, key: str, response: str, *, max_size: int, since: int
+    ) -> None:
+        """
+        This function will cache a language model response, evicting expired and least recently used ones to stay under `max_size`.
+
+        :param key: The hash identifying the request.
+        :param response: The response of the model.
+        :param max_size: The maximum total size of the cached responses, in bytes.
+        :param since: Responses cached before this UNIX timestamp are evicted.
+        """
+        async with self.lock:
+            await self.connection.execute(
+                """
+                INSERT OR REPLACE INTO llm_cache(key, response, size, created_at, accessed_at)
+                VALUES (?, ?, ?, strftime('%s', 'now'), strftime('%s', 'now'))
+                """,
+                (key, response, len(response.encode())),
+            )
+            await self.connection.execute("DELETE FROM llm_cache WHERE created_at<?", (since,))
+            await self.connection.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS total FROM llm_cache
+                    ) WHERE total>?
+                )
+                """,
+                (max_size,),
+            )
+            await self.connection.commit()
+
+    @_timed
+    async def get_names(self, target_ids: Collection[int], *, since: int) -> dict[int, str]:
+        """
+        This function will get the remembered names of users.
+
+        :param target_ids: The IDs whose names should be looked up.
+        :param since: Names remembered before this UNIX timestamp are considered expired.
+        :return: A dictionary from ID to name, IDs without a name are left out.
+        """
+        target_ids = list(target_ids)
+        names = {}
+        # Stays well under SQLite's limit on the number of parameters of a statement.
+        for i in range(0, len(target_ids), 500):
+            chunk = target_ids[i : i + 500]
+            rows = await self.connection.execute(
+                f"SELECT target_id, name FROM names WHERE updated_at>=? AND target_id IN ({', '.join('?' * len(chunk))})",
+                (since, *chunk),
+            )
+            async with rows as cursor:
+                names.update(await cursor.fetchall())
+        return names
+
+    @_timed
+    async def set_names(self, names: dict[int, str]) -> None:
+        """
+        This function will remember the names of users.
+
+        :param names: A dictionary from ID to name.
+        """
+        if not names:
+            return
+        async with self.lock:
+            await self.connection.executemany(
+                "INSERT OR REPLACE INTO names(target_id, name, updated_at) VALUES (?, ?, strftime('%s', 'now'))",
+                names.items(),
+            )
+            await self.connection.commit()
+
+    @_timed
+    async def get_scrape_state(self, channel_id: int) -> tuple | None:
+        """
+        This function will get the scraping checkpoint of a channel.
+
+        :param channel_id: The ID of the channel that should be checked.
+        :return: A `(last_message_id, oldest_message_id, backfill)` tuple, or `None` if the channel was never scraped.
+        """
+        rows = await self.connection.execute(
+            "SELECT last_message_id, oldest_message_id, backfill FROM scrape_state WHERE channel_id=?",
+            (channel_id,),
+        )
+        async with rows as cursor:
+            return await cursor.fetchone()
+
+    @_timed
+    async def set_scrape_state(
+        self,
+        channel_id: int,
+        server_id: int,
+        *,
+        last_message_id: int | None = None,
+        oldest_message_id: int | None = None,
+        backfill: int | None = None,
+    ) -> None:
+        """
+        This function will update the scraping checkpoint of a channel, fields left as `None` are kept as they are.
+
+        :param channel_id: The ID of the channel that was scraped.
+        :param server_id: The ID of the server the channel belongs to.
+        :param last_message_id: The ID of the newest message that has been logged.
+        :param oldest_message_id: The ID of the oldest message that has been logged.
+        :param backfill: The backfill state, 0 when not requested, 1 when pending and 2 when done.
+        """
+        async with self.lock:
+            await self.connection.execute(
+                """
+                INSERT INTO scrape_state(channel_id, server_id, last_message_id, oldest_message_id, backfill)
+                VALUES (?, ?, ?, ?, COALESCE(?, 0))
+                ON CONFLICT(channel_id) DO UPDATE SET
+                    last_message_id=COALESCE(excluded.last_message_id, last_message_id),
+                    oldest_message_id=COALESCE(excluded.oldest_message_id, oldest_message_id),
+                    backfill=COALESCE(?, backfill)
+                """,
+                (channel_id, server_id, last_message_id, oldest_message_id, backfill, backfill),
+            )
+            await self.connection.commit()
+
+    @_timed
+    async def get_pending_backfills(self) -> list:
+        """
+        This function will get every channel that has an unfinished backfill.
+
+        :return: A list of `(server_id, channel_id)` tuples.
+        """
+        rows = await self.connection.execute(
+            "SELECT server_id, channel_id FROM scrape_state WHERE backfill=1"
+        )
+        async with rows as cursor:
+            return await cursor.fetchall()
+
+    @_timed
+    async def get_capture_targets(self) -> list[int]:
+        """
+        This function will get every server and channel that has live capture enabled.
+
+        :return: A list of server and channel IDs.
+        """
+        rows = await self.connection.execute("SELECT target_id FROM capture")
+        async with rows as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    @_timed
+    async def set_capture(self, server_id: int, target_id: int, enabled: bool) -> None:
+        """
+        This function will enable or disable live capture for a server or one of its channels.
+
+        :param server_id: The ID of the server the target belongs to.
+        :param target_id: The ID of the server itself or of one of its channels.
+        :param enabled: Whether messages sent in the target should be captured.
+        """
+        async with self.lock:
+            if enabled:
+                await self.connection.execute(
+                    "INSERT OR IGNORE INTO capture(server_id, target_id) VALUES (?, ?)",
+                    (server_id, target_id),
+                )
+            else:
+                await self.connection.execute(
+                    "DELETE FROM capture WHERE target_id=?", (target_id,)
+                )
+            await self.connection.commit()
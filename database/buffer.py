@@ -0,0 +1,135 @@
+"""
+Write-behind buffer in front of `DatabaseManager` so that message ingestion never waits on SQLite.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from database import DatabaseManager
+
+logger = logging.getLogger("discord_bot")
+
+
+class MessageBuffer:
+    def __init__(
+        self,
+        database: DatabaseManager,
+        *,
+        max_size: int = 512,
+        interval: float = 2.0,
+    ) -> None:
+        """
+        Buffers logged messages in memory and writes them out in batches.
+
+        :param database: The database manager the batches are written to.
+        :param max_size: The number of pending rows that triggers an early flush.
+        :param interval: The maximum number of seconds a row waits before being flushed.
+        """
+        self.database = database
+        self.max_size = max_size
+        self.interval = interval
+        self._pending: list[tuple[str, tuple]] = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, message) -> None:
+        """
+        Enqueues a message to be logged. This never blocks, so it is safe to call from event handlers.
+
+        :param message: The Discord message that should be logged.
+        """
+        self._enqueue(
+            "add",
+            (
+                message.id,
+                message.channel.id,
+                message.guild.id,
+                message.author.id,
+                message.content,
+                int(message.created_at.timestamp()),
+            ),
+        )
+
+    def put_edit(self, message_id: int, content: str) -> None:
+        """
+        Enqueues the edit of a logged message, it is applied after every write queued before it.
+
+        :param message_id: The ID of the edited message.
+        :param content: The content of the message after the edit.
+        """
+        self._enqueue("edit", (content, message_id))
+
+    def put_delete(self, message_id: int) -> None:
+        """
+        Enqueues the deletion of a logged message, it is applied after every write queued before it.
+
+        :param message_id: The ID of the deleted message.
+        """
+        self._enqueue("delete", (message_id,))
+
+    def _enqueue(self, kind: str, parameters: tuple) -> None:
+        self._pending.append((kind, parameters))
+        if len(self._pending) >= self.max_size:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        """
+        Starts the background flusher, must be called from within the running event loop.
+        """
+        if self._task is None or self._task.done():
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run(), name="message-buffer")
+
+    async def flush(self) -> int:
+        """
+        Writes every pending row to the database in a single transaction.
+
+        :return: The number of rows that were changed.
+        """
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, []
+            try:
+                return await self.database.write_batch(batch)
+            except BaseException:
+                # Put the batch back in front so nothing is lost on a transient error or when the
+                # caller is cancelled. Replaying it is harmless, every queued write is idempotent.
+                self._pending[:0] = batch
+                raise
+
+    async def close(self) -> None:
+        """
+        Stops the background flusher and drains whatever is still pending.
+        """
+        if self._task is not None:
+            # The flusher is left to finish the batch it may be writing, cancelling it would
+            # interrupt the write.
+            self._stopping.set()
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush message buffer\n{type(e).__name__}: {e}")
@@ -0,0 +1,29 @@
+-- Version 1 stored snowflakes as text, had no message or channel IDs and
+-- deduplicated on a UNIQUE index over the whole message text. Rows logged
+-- before this migration have no message ID, so they get negative IDs that can
+-- never collide with a real snowflake, and keep their insertion time.
+ALTER TABLE `logs` RENAME TO `logs_v1`;
+
+CREATE TABLE
+  `logs` (
+    `message_id` INTEGER NOT NULL PRIMARY KEY,
+    `channel_id` INTEGER NOT NULL,
+    `server_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `message` text NOT NULL,
+    `created_at` INTEGER NOT NULL
+  );
+
+INSERT INTO
+  `logs` (`message_id`, `channel_id`, `server_id`, `user_id`, `message`, `created_at`)
+SELECT
+  -`rowid`,
+  0,
+  CAST(`server_id` AS INTEGER),
+  CAST(`user_id` AS INTEGER),
+  `message`,
+  CAST(strftime('%s', `created_at`) AS INTEGER)
+FROM
+  `logs_v1`;
+
+DROP TABLE `logs_v1`;
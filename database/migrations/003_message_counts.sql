@@ -0,0 +1,43 @@
+-- Daily message counts per server, channel and user, kept up to date by
+-- triggers on `logs` so that `!topUsers` never has to scan the logs.
+CREATE TABLE
+  IF NOT EXISTS `message_counts` (
+    `server_id` INTEGER NOT NULL,
+    `day` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `count` INTEGER NOT NULL,
+    PRIMARY KEY (`server_id`, `day`, `channel_id`, `user_id`)
+  ) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS `logs_count_insert` AFTER INSERT ON `logs`
+BEGIN
+  INSERT INTO
+    `message_counts` (`server_id`, `day`, `channel_id`, `user_id`, `count`)
+  VALUES
+    (NEW.`server_id`, NEW.`created_at` / 86400, NEW.`channel_id`, NEW.`user_id`, 1)
+  ON CONFLICT (`server_id`, `day`, `channel_id`, `user_id`) DO UPDATE SET `count` = `count` + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS `logs_count_delete` AFTER DELETE ON `logs`
+BEGIN
+  UPDATE `message_counts`
+  SET `count` = `count` - 1
+  WHERE `server_id` = OLD.`server_id`
+    AND `day` = OLD.`created_at` / 86400
+    AND `channel_id` = OLD.`channel_id`
+    AND `user_id` = OLD.`user_id`;
+END;
+
+INSERT INTO
+  `message_counts` (`server_id`, `day`, `channel_id`, `user_id`, `count`)
+SELECT
+  `server_id`,
+  `created_at` / 86400,
+  `channel_id`,
+  `user_id`,
+  COUNT(*)
+FROM
+  `logs`
+GROUP BY
+  1, 2, 3, 4;
@@ -0,0 +1,49 @@
+-- Word counts per server, day and channel behind `!frequency`. Triggers on
+-- `logs` queue every inserted, edited or deleted message in `term_queue`, which
+-- `DatabaseManager.index_terms` tokenizes into `term_counts`. Existing messages
+-- are queued here and indexed in the background once the bot is running.
+CREATE TABLE
+  IF NOT EXISTS `term_counts` (
+    `server_id` INTEGER NOT NULL,
+    `day` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `term` text NOT NULL,
+    `count` INTEGER NOT NULL,
+    PRIMARY KEY (`server_id`, `day`, `channel_id`, `term`)
+  ) WITHOUT ROWID;
+
+CREATE TABLE
+  IF NOT EXISTS `term_queue` (
+    `server_id` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `created_at` INTEGER NOT NULL,
+    `message` text NOT NULL,
+    `sign` INTEGER NOT NULL
+  );
+
+CREATE TRIGGER IF NOT EXISTS `logs_terms_insert` AFTER INSERT ON `logs`
+BEGIN
+  INSERT INTO `term_queue` VALUES (NEW.`server_id`, NEW.`channel_id`, NEW.`created_at`, NEW.`message`, 1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS `logs_terms_delete` AFTER DELETE ON `logs`
+BEGIN
+  INSERT INTO `term_queue` VALUES (OLD.`server_id`, OLD.`channel_id`, OLD.`created_at`, OLD.`message`, -1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS `logs_terms_update` AFTER UPDATE OF `message` ON `logs`
+BEGIN
+  INSERT INTO `term_queue` VALUES (OLD.`server_id`, OLD.`channel_id`, OLD.`created_at`, OLD.`message`, -1);
+  INSERT INTO `term_queue` VALUES (NEW.`server_id`, NEW.`channel_id`, NEW.`created_at`, NEW.`message`, 1);
+END;
+
+INSERT INTO
+  `term_queue`
+SELECT
+  `server_id`,
+  `channel_id`,
+  `created_at`,
+  `message`,
+  1
+FROM
+  `logs`;
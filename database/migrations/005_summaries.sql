@@ -0,0 +1,72 @@
+-- One stored summary per channel and hour (level 0) and per channel and day
+-- (level 1), behind `!summary` and `!topics`. Triggers on `logs` mark the
+-- buckets a message falls in as dirty, bumping `version` so that a summary
+-- written while new messages arrive does not clear the newer change. Existing
+-- history is marked dirty here and summarised in the background.
+CREATE TABLE
+  IF NOT EXISTS `summaries` (
+    `level` INTEGER NOT NULL,
+    `server_id` INTEGER NOT NULL,
+    `bucket` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `summary` text NOT NULL,
+    PRIMARY KEY (`level`, `server_id`, `bucket`, `channel_id`)
+  ) WITHOUT ROWID;
+
+CREATE TABLE
+  IF NOT EXISTS `summary_dirty` (
+    `level` INTEGER NOT NULL,
+    `server_id` INTEGER NOT NULL,
+    `bucket` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `version` INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (`level`, `server_id`, `bucket`, `channel_id`)
+  ) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS `logs_summary_insert` AFTER INSERT ON `logs`
+BEGIN
+  INSERT INTO
+    `summary_dirty` (`level`, `server_id`, `bucket`, `channel_id`)
+  VALUES
+    (0, NEW.`server_id`, NEW.`created_at` / 3600, NEW.`channel_id`),
+    (1, NEW.`server_id`, NEW.`created_at` / 86400, NEW.`channel_id`)
+  ON CONFLICT (`level`, `server_id`, `bucket`, `channel_id`) DO UPDATE SET `version` = `version` + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS `logs_summary_delete` AFTER DELETE ON `logs`
+BEGIN
+  INSERT INTO
+    `summary_dirty` (`level`, `server_id`, `bucket`, `channel_id`)
+  VALUES
+    (0, OLD.`server_id`, OLD.`created_at` / 3600, OLD.`channel_id`),
+    (1, OLD.`server_id`, OLD.`created_at` / 86400, OLD.`channel_id`)
+  ON CONFLICT (`level`, `server_id`, `bucket`, `channel_id`) DO UPDATE SET `version` = `version` + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS `logs_summary_update` AFTER UPDATE OF `message` ON `logs`
+BEGIN
+  INSERT INTO
+    `summary_dirty` (`level`, `server_id`, `bucket`, `channel_id`)
+  VALUES
+    (0, NEW.`server_id`, NEW.`created_at` / 3600, NEW.`channel_id`),
+    (1, NEW.`server_id`, NEW.`created_at` / 86400, NEW.`channel_id`)
+  ON CONFLICT (`level`, `server_id`, `bucket`, `channel_id`) DO UPDATE SET `version` = `version` + 1;
+END;
+
+INSERT INTO
+  `summary_dirty` (`level`, `server_id`, `bucket`, `channel_id`)
+SELECT DISTINCT
+  0,
+  `server_id`,
+  `created_at` / 3600,
+  `channel_id`
+FROM
+  `logs`
+UNION
+SELECT DISTINCT
+  1,
+  `server_id`,
+  `created_at` / 86400,
+  `channel_id`
+FROM
+  `logs`;
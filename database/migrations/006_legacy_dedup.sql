@@ -0,0 +1,22 @@
+-- Rows carried over from version 1 have negative IDs (see 002), so a scrape
+-- that fetches the same message again cannot be ignored as a duplicate. When
+-- the real message arrives, one legacy row with the same author and text is
+-- deleted, which the delete triggers take out of the counts, the word index
+-- and the summaries. The same text sent on several days left several legacy
+-- rows, the others stay until their own messages are scraped.
+CREATE INDEX IF NOT EXISTS `logs_legacy` ON `logs` (`server_id`, `user_id`, `message`)
+WHERE `message_id` < 0;
+
+CREATE TRIGGER IF NOT EXISTS `logs_legacy_replace` AFTER INSERT ON `logs`
+WHEN NEW.`message_id` > 0
+BEGIN
+  DELETE FROM `logs`
+  WHERE `message_id` = (
+    SELECT `message_id` FROM `logs`
+    WHERE `message_id` < 0
+      AND `server_id` = NEW.`server_id`
+      AND `user_id` = NEW.`user_id`
+      AND `message` = NEW.`message`
+    LIMIT 1
+  );
+END;
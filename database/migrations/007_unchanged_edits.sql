@@ -0,0 +1,24 @@
+-- Discord sends a message update with the same content when a link preview is
+-- added, which re-tokenized the message and dirtied its summaries for nothing.
+-- The update triggers of 004 and 005 now only fire when the text changed.
+DROP TRIGGER IF EXISTS `logs_terms_update`;
+
+CREATE TRIGGER `logs_terms_update` AFTER UPDATE OF `message` ON `logs`
+WHEN OLD.`message` IS NOT NEW.`message`
+BEGIN
+  INSERT INTO `term_queue` VALUES (OLD.`server_id`, OLD.`channel_id`, OLD.`created_at`, OLD.`message`, -1);
+  INSERT INTO `term_queue` VALUES (NEW.`server_id`, NEW.`channel_id`, NEW.`created_at`, NEW.`message`, 1);
+END;
+
+DROP TRIGGER IF EXISTS `logs_summary_update`;
+
+CREATE TRIGGER `logs_summary_update` AFTER UPDATE OF `message` ON `logs`
+WHEN OLD.`message` IS NOT NEW.`message`
+BEGIN
+  INSERT INTO
+    `summary_dirty` (`level`, `server_id`, `bucket`, `channel_id`)
+  VALUES
+    (0, NEW.`server_id`, NEW.`created_at` / 3600, NEW.`channel_id`),
+    (1, NEW.`server_id`, NEW.`created_at` / 86400, NEW.`channel_id`)
+  ON CONFLICT (`level`, `server_id`, `bucket`, `channel_id`) DO UPDATE SET `version` = `version` + 1;
+END;
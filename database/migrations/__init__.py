@@ -0,0 +1,70 @@
+"""
+Applies the numbered `NNN_*.sql` scripts in this directory to bring an existing database up to date.
+
+The schema version is kept in `PRAGMA user_version`. Databases created before versioning existed
+report version 0 while already having a `logs` table, and are treated as version 1. A brand new
+database is created straight from `schema.sql` and never runs any migration.
+"""
+
+import logging
+import os
+import re
+
+import aiosqlite
+
+logger = logging.getLogger("discord_bot")
+
+MIGRATIONS_PATH = os.path.realpath(os.path.dirname(__file__))
+
+
+def list_migrations() -> list[tuple[int, str]]:
+    """
+    Lists the migration scripts, sorted by the version they upgrade to.
+
+    :return: A list of `(version, path)` tuples.
+    """
+    migrations = []
+    for file in os.listdir(MIGRATIONS_PATH):
+        match = re.match(r"^(\d+)_.*\.sql$", file)
+        if match:
+            migrations.append((int(match.group(1)), os.path.join(MIGRATIONS_PATH, file)))
+    return sorted(migrations)
+
+
+def latest_version() -> int:
+    """
+    The schema version described by `schema.sql`.
+    """
+    migrations = list_migrations()
+    return migrations[-1][0] if migrations else 1
+
+
+async def migrate(connection: aiosqlite.Connection) -> int:
+    """
+    Upgrades the database in place, each migration runs in its own transaction.
+
+    :param connection: The connection to the database that should be upgraded.
+    :return: The schema version the database is at afterwards.
+    """
+    async with connection.execute("PRAGMA user_version") as cursor:
+        version = (await cursor.fetchone())[0]
+    if version == 0:
+        async with connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='logs'"
+        ) as cursor:
+            version = 1 if await cursor.fetchone() is not None else latest_version()
+
+    for target, path in list_migrations():
+        if target <= version:
+            continue
+        logger.info(f"Migrating database to version {target} ({os.path.basename(path)})")
+        with open(path) as file:
+            script = file.read()
+        await connection.executescript(
+            f"BEGIN;\n{script}\nPRAGMA user_version={target};\nCOMMIT;"
+        )
+        version = target
+
+    await connection.execute(f"PRAGMA user_version={version}")
+    await connection.commit()
+    return version
@@ -9,9 +9,180 @@ CREATE TABLE IF NOT EXISTS `warns` (
 
 CREATE TABLE
   IF NOT EXISTS `logs` (
-    `user_id` varchar(20) NOT NULL,
-    `server_id` varchar(20) NOT NULL,
+    `message_id` INTEGER NOT NULL PRIMARY KEY,
+    `channel_id` INTEGER NOT NULL,
+    `server_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
     `message` text NOT NULL,
-    `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE (`user_id`, `server_id`, `message`, `created_at`)
-  )
\ No newline at end of file
+    `created_at` INTEGER NOT NULL
+  );
+
+CREATE INDEX IF NOT EXISTS `logs_server_created` ON `logs` (`server_id`, `created_at`);
+
+CREATE INDEX IF NOT EXISTS `logs_server_user` ON `logs` (`server_id`, `user_id`, `created_at`);
+
+CREATE INDEX IF NOT EXISTS `logs_legacy` ON `logs` (`server_id`, `user_id`, `message`)
+WHERE `message_id` < 0;
+
+CREATE TRIGGER IF NOT EXISTS `logs_legacy_replace` AFTER INSERT ON `logs`
+WHEN NEW.`message_id` > 0
+BEGIN
+  DELETE FROM `logs`
+  WHERE `message_id` = (
+    SELECT `message_id` FROM `logs`
+    WHERE `message_id` < 0
+      AND `server_id` = NEW.`server_id`
+      AND `user_id` = NEW.`user_id`
+      AND `message` = NEW.`message`
+    LIMIT 1
+  );
+END;
+
+CREATE TABLE
+  IF NOT EXISTS `scrape_state` (
+    `channel_id` INTEGER NOT NULL PRIMARY KEY,
+    `server_id` INTEGER NOT NULL,
+    `last_message_id` INTEGER,
+    `oldest_message_id` INTEGER,
+    `backfill` INTEGER NOT NULL DEFAULT 0
+  );
+
+CREATE TABLE
+  IF NOT EXISTS `capture` (
+    `target_id` INTEGER NOT NULL PRIMARY KEY,
+    `server_id` INTEGER NOT NULL
+  );
+
+CREATE TABLE
+  IF NOT EXISTS `message_counts` (
+    `server_id` INTEGER NOT NULL,
+    `day` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `count` INTEGER NOT NULL,
+    PRIMARY KEY (`server_id`, `day`, `channel_id`, `user_id`)
+  ) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS `logs_count_insert` AFTER INSERT ON `logs`
+BEGIN
+  INSERT INTO
+    `message_counts` (`server_id`, `day`, `channel_id`, `user_id`, `count`)
+  VALUES
+    (NEW.`server_id`, NEW.`created_at` / 86400, NEW.`channel_id`, NEW.`user_id`, 1)
+  ON CONFLICT (`server_id`, `day`, `channel_id`, `user_id`) DO UPDATE SET `count` = `count` + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS `logs_count_delete` AFTER DELETE ON `logs`
+BEGIN
+  UPDATE `message_counts`
+  SET `count` = `count` - 1
+  WHERE `server_id` = OLD.`server_id`
+    AND `day` = OLD.`created_at` / 86400
+    AND `channel_id` = OLD.`channel_id`
+    AND `user_id` = OLD.`user_id`;
+END;
+
+CREATE TABLE
+  IF NOT EXISTS `term_counts` (
+    `server_id` INTEGER NOT NULL,
+    `day` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `term` text NOT NULL,
+    `count` INTEGER NOT NULL,
+    PRIMARY KEY (`server_id`, `day`, `channel_id`, `term`)
+  ) WITHOUT ROWID;
+
+CREATE TABLE
+  IF NOT EXISTS `term_queue` (
+    `server_id` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `created_at` INTEGER NOT NULL,
+    `message` text NOT NULL,
+    `sign` INTEGER NOT NULL
+  );
+
+CREATE TRIGGER IF NOT EXISTS `logs_terms_insert` AFTER INSERT ON `logs`
+BEGIN
+  INSERT INTO `term_queue` VALUES (NEW.`server_id`, NEW.`channel_id`, NEW.`created_at`, NEW.`message`, 1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS `logs_terms_delete` AFTER DELETE ON `logs`
+BEGIN
+  INSERT INTO `term_queue` VALUES (OLD.`server_id`, OLD.`channel_id`, OLD.`created_at`, OLD.`message`, -1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS `logs_terms_update` AFTER UPDATE OF `message` ON `logs`
+WHEN OLD.`message` IS NOT NEW.`message`
+BEGIN
+  INSERT INTO `term_queue` VALUES (OLD.`server_id`, OLD.`channel_id`, OLD.`created_at`, OLD.`message`, -1);
+  INSERT INTO `term_queue` VALUES (NEW.`server_id`, NEW.`channel_id`, NEW.`created_at`, NEW.`message`, 1);
+END;
+
+CREATE TABLE
+  IF NOT EXISTS `summaries` (
+    `level` INTEGER NOT NULL,
+    `server_id` INTEGER NOT NULL,
+    `bucket` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `summary` text NOT NULL,
+    PRIMARY KEY (`level`, `server_id`, `bucket`, `channel_id`)
+  ) WITHOUT ROWID;
+
+CREATE TABLE
+  IF NOT EXISTS `summary_dirty` (
+    `level` INTEGER NOT NULL,
+    `server_id` INTEGER NOT NULL,
+    `bucket` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `version` INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (`level`, `server_id`, `bucket`, `channel_id`)
+  ) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS `logs_summary_insert` AFTER INSERT ON `logs`
+BEGIN
+  INSERT INTO
+    `summary_dirty` (`level`, `server_id`, `bucket`, `channel_id`)
+  VALUES
+    (0, NEW.`server_id`, NEW.`created_at` / 3600, NEW.`channel_id`),
+    (1, NEW.`server_id`, NEW.`created_at` / 86400, NEW.`channel_id`)
+  ON CONFLICT (`level`, `server_id`, `bucket`, `channel_id`) DO UPDATE SET `version` = `version` + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS `logs_summary_delete` AFTER DELETE ON `logs`
+BEGIN
+  INSERT INTO
+    `summary_dirty` (`level`, `server_id`, `bucket`, `channel_id`)
+  VALUES
+    (0, OLD.`server_id`, OLD.`created_at` / 3600, OLD.`channel_id`),
+    (1, OLD.`server_id`, OLD.`created_at` / 86400, OLD.`channel_id`)
+  ON CONFLICT (`level`, `server_id`, `bucket`, `channel_id`) DO UPDATE SET `version` = `version` + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS `logs_summary_update` AFTER UPDATE OF `message` ON `logs`
+WHEN OLD.`message` IS NOT NEW.`message`
+BEGIN
+  INSERT INTO
+    `summary_dirty` (`level`, `server_id`, `bucket`, `channel_id`)
+  VALUES
+    (0, NEW.`server_id`, NEW.`created_at` / 3600, NEW.`channel_id`),
+    (1, NEW.`server_id`, NEW.`created_at` / 86400, NEW.`channel_id`)
+  ON CONFLICT (`level`, `server_id`, `bucket`, `channel_id`) DO UPDATE SET `version` = `version` + 1;
+END;
+
+CREATE TABLE
+  IF NOT EXISTS `llm_cache` (
+    `key` text NOT NULL PRIMARY KEY,
+    `response` text NOT NULL,
+    `size` INTEGER NOT NULL,
+    `created_at` INTEGER NOT NULL,
+    `accessed_at` INTEGER NOT NULL
+  );
+
+CREATE INDEX IF NOT EXISTS `llm_cache_accessed` ON `llm_cache` (`accessed_at`);
+
+CREATE TABLE
+  IF NOT EXISTS `names` (
+    `target_id` INTEGER NOT NULL PRIMARY KEY,
+    `name` text NOT NULL,
+    `updated_at` INTEGER NOT NULL
+  );
@@ -0,0 +1,30 @@
+"""
+Fallback tokenizer used to build the `term_counts` word-frequency index when spaCy is not available.
+"""
+
+import re
+from collections.abc import Awaitable, Callable, Sequence
+
+# Turns a batch of messages into their lowercase words, see `helpers.nlp.NLPService.terms`.
+Tokenizer = Callable[[Sequence[str]], Awaitable[list[list[str]]]]
+
+# Runs of letters, the same tokens spaCy reports as `is_alpha` for plain chat text.
+_WORD = re.compile(r"[^\W\d_]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Splits a message into lowercase words, dropping numbers, punctuation and emoji.
+
+    :param text: The content of the message.
+    """
+    return _WORD.findall(text.lower())
+
+
+async def tokenize_all(texts: Sequence[str]) -> list[list[str]]:
+    """
+    Tokenizes a batch of messages with `tokenize`, this is the default `Tokenizer`.
+
+    :param texts: The contents of the messages.
+    """
+    return [tokenize(text) for text in texts]
@@ -0,0 +1,134 @@
+"""
+Chart rendering in worker processes, with a cache of the rendered PNG bytes.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+from collections import OrderedDict
+
+from helpers.workers import WorkerPool
+
+
+def _init_worker() -> None:
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _render_bar(
+    *, title: str, labels: list[str], values: list[float], xlabel: str, ylabel: str
+) -> bytes:
+    # The object-oriented API keeps the figure out of pyplot's global registry, so it is
+    # freed as soon as it goes out of scope instead of leaking until `plt.close`.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(10, 5))
+    FigureCanvasAgg(figure)
+    axes = figure.subplots()
+    axes.bar(labels, values)
+    axes.set_xlabel(xlabel)
+    axes.set_ylabel(ylabel)
+    axes.set_title(title)
+
+    buf = io.BytesIO()
+    figure.savefig(buf, format="png")
+    figure.clear()
+    return buf.getvalue()
+
+
+_CHARTS = {
+    "bar": _render_bar,
+}
+
+
+def _render(kind: str, data: dict) -> bytes:
+    return _CHARTS[kind](**data)
+
+
+class ChartRenderer:
+    def __init__(self, *, processes: int = 2, cache_size: int = 128) -> None:
+        """
+        Renders charts to PNG off the event loop and remembers the most recent ones.
+
+        :param processes: The number of worker processes.
+        :param cache_size: The number of rendered charts kept in memory.
+        """
+        self.processes = processes
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, bytes] = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._pool = WorkerPool("chart", processes, initializer=_init_worker)
+
+    async def bar(
+        self,
+        labels: list[str],
+        values: list[float],
+        *,
+        title: str = "",
+        xlabel: str = "",
+        ylabel: str = "",
+    ) -> bytes:
+        """
+        Renders a bar chart.
+
+        :param labels: The label of each bar.
+        :param values: The height of each bar.
+        :param title: The title of the chart.
+        :param xlabel: The label of the X axis.
+        :param ylabel: The label of the Y axis.
+        :return: The chart as PNG bytes.
+        """
+        return await self.render(
+            "bar",
+            title=title,
+            labels=list(labels),
+            values=list(values),
+            xlabel=xlabel,
+            ylabel=ylabel,
+        )
+
+    async def render(self, kind: str, **data) -> bytes:
+        """
+        Renders a chart, identical charts are served from the cache or share a single render.
+
+        :param kind: The type of chart, such as `bar`.
+        :param data: The arguments of the chart, they must be JSON serializable.
+        :return: The chart as PNG bytes.
+        """
+        key = hashlib.sha256(
+            json.dumps([kind, data], sort_keys=True).encode()
+        ).hexdigest()
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if key in self._pending:
+            self.hits += 1
+            return await asyncio.shield(self._pending[key])
+
+        self.misses += 1
+        if not self._pool.started:
+            # Most days nobody asks for a chart, matplotlib is only loaded once somebody does.
+            self._pool.start()
+        future = asyncio.ensure_future(self._pool.run(_render, kind, data))
+        self._pending[key] = future
+        try:
+            png = await asyncio.shield(future)
+        finally:
+            self._pending.pop(key, None)
+
+        self._cache[key] = png
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return png
+
+    async def close(self) -> None:
+        """
+        Stops the worker processes.
+        """
+        await self._pool.close()
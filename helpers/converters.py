@@ -0,0 +1,105 @@
+"""
+Converters shared by the commands that read the logged message history.
+"""
+
+import re
+import time
+from datetime import timedelta
+from typing import Literal
+
+import discord
+from discord.ext import commands
+
+_DURATION_UNITS = {
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 60 * 60 * 24,
+    "w": 60 * 60 * 24 * 7,
+}
+
+
+class Duration(commands.Converter):
+    async def convert(self, context: commands.Context, argument: str) -> timedelta:
+        """
+        Converts durations such as `30m`, `12h` or `1w2d` into a `timedelta`.
+
+        :param context: The context of the command being invoked.
+        :param argument: The duration as typed by the user.
+        """
+        argument = argument.strip().lower()
+        if not re.fullmatch(r"(\d+\s*[smhdw]\s*)+", argument):
+            raise commands.BadArgument(
+                f"`{argument}` is not a duration, try something like `12h` or `7d`."
+            )
+        parts = re.findall(r"(\d+)\s*([smhdw])", argument)
+        return timedelta(
+            seconds=sum(int(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+        )
+
+
+class HistoryFlags(commands.FlagConverter):
+    since: Duration | None = commands.flag(
+        default=None, description="Only include messages from this far back, e.g. 7d."
+    )
+    channel: discord.TextChannel | None = commands.flag(
+        default=None, description="Only include messages sent in this channel."
+    )
+    user: discord.User | None = commands.flag(
+        default=None, description="Only include messages sent by this user."
+    )
+
+    def filters(self) -> dict:
+        """
+        The keyword arguments to pass to `DatabaseManager.iter_msgs` to apply these flags.
+        """
+        return {
+            "since": int(time.time() - self.since.total_seconds()) if self.since else None,
+            "channel_id": self.channel.id if self.channel else None,
+            "user_id": self.user.id if self.user else None,
+        }
+
+    def describe(self) -> str:
+        """
+        A short human readable description of the active filters, empty if there are none.
+        """
+        parts = []
+        if self.since:
+            parts.append(f"in the last {self.since}")
+        if self.channel:
+            parts.append(f"in {self.channel.mention}")
+        if self.user:
+            parts.append(f"by {self.user.mention}")
+        return " ".join(parts)
+
+
+class FrequencyFlags(HistoryFlags):
+    stopwords: bool = commands.flag(
+        default=False, description="Include common words such as 'the' and 'and'."
+    )
+
+
+class DumpFlags(HistoryFlags):
+    until: Duration | None = commands.flag(
+        default=None, description="Only include messages from at least this far back, e.g. 1d."
+    )
+    format: Literal["ndjson", "csv"] = commands.flag(
+        default="ndjson", description="The format of the exported file, ndjson or csv."
+    )
+
+    def filters(self) -> dict:
+        """
+        The keyword arguments to pass to `DatabaseManager.iter_msgs` to apply these flags.
+        """
+        filters = super().filters()
+        filters["until"] = int(time.time() - self.until.total_seconds()) if self.until else None
+        return filters
+
+    def describe(self) -> str:
+        """
+        A short human readable description of the active filters, empty if there are none.
+        """
+        description = super().describe()
+        if self.until:
+            description = f"{description} up to {self.until} ago".strip()
+        return description
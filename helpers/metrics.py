@@ -0,0 +1,307 @@
+"""
+Counters, gauges and latency histograms, served in the Prometheus text format on a local port.
+"""
+
+import asyncio
+import functools
+import logging
+import math
+import time
+from collections.abc import Callable, Iterable
+from contextlib import contextmanager
+
+from aiohttp import web
+
+logger = logging.getLogger("discord_bot")
+
+# From 1ms to 5 minutes, the slowest LLM calls still land in a bucket.
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        """
+        A named series of values, one per combination of label values.
+
+        :param name: The name of the metric, as shown to Prometheus.
+        :param documentation: What the metric measures.
+        :param labels: The names of the labels every value is recorded with.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(_escape(labels.get(name, "")) for name in self.labels)
+
+    def render(self) -> list[str]:
+        """
+        The lines describing this metric in the Prometheus text format.
+        """
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increases the counter of the given labels.
+        """
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labels, key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        """
+        Sets the value of the given labels.
+        """
+        self._values[self._key(labels)] = value
+
+    def render(self) -> list[str]:
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labels, key)} {value}"
+            for key, value in self._values.items()
+            if not math.isnan(value)
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        *,
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: the count of every bucket, then the sum and the total count.
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Records a value, usually a duration in seconds.
+        """
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Records how long the body of the `with` statement took.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def wrap(self, function: Callable, **labels) -> Callable:
+        """
+        Wraps a coroutine function so that every call records how long it took.
+        """
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with self.time(**labels):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                labels = _format_labels(self.labels, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        """
+        The set of metrics that are served together.
+        """
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Adds a metric, its name has to be unique.
+
+        :param metric: The metric that should be served.
+        :return: The metric, so this can be used on assignment.
+        """
+        if metric.name in self._metrics:
+            raise ValueError(f"A metric called {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text format.
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+COMMAND_LATENCY = REGISTRY.register(Histogram(
+    "discord_command_duration_seconds",
+    "Time from the invocation of a command to its completion.",
+    ("command", "status"),
+))
+DATABASE_LATENCY = REGISTRY.register(Histogram(
+    "database_query_duration_seconds",
+    "Time spent in each DatabaseManager method, waiting for the write lock included.",
+    ("method",),
+))
+LLM_LATENCY = REGISTRY.register(Histogram(
+    "llm_call_duration_seconds",
+    "Time a single call to the language model took, by whether it was answered from the cache.",
+    ("model", "outcome"),
+))
+LLM_QUEUE_WAIT = REGISTRY.register(Histogram(
+    "llm_queue_wait_seconds",
+    "Time a call to the language model waited for its turn in the scheduler.",
+))
+LLM_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "llm_queue_depth",
+    "Number of calls to the language model waiting for their turn.",
+))
+LLM_RUNNING = REGISTRY.register(Gauge(
+    "llm_running_calls",
+    "Number of calls to the language model in flight.",
+))
+GATEWAY_LATENCY = REGISTRY.register(Gauge(
+    "discord_gateway_latency_seconds",
+    "Time between a gateway heartbeat and its acknowledgement.",
+))
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop woke up a sleeping task.",
+))
+EVENT_LOOP_STALLS = REGISTRY.register(Counter(
+    "event_loop_stalls_total",
+    "Number of times the event loop was blocked for longer than the watchdog threshold.",
+    ("offender",),
+))
+
+
+class MetricsServer:
+    def __init__(
+        self,
+        bot,
+        *,
+        port: int,
+        host: str = "127.0.0.1",
+        interval: float = 0.5,
+        registry: Registry = REGISTRY,
+    ) -> None:
+        """
+        Serves the metrics on `http://host:port/metrics` and samples the ones nothing else records.
+
+        :param bot: The bot whose gateway latency is sampled.
+        :param port: The port to listen on.
+        :param host: The address to listen on, only the local machine by default.
+        :param interval: The number of seconds between two samples of the event loop lag.
+        :param registry: The metrics to serve.
+        """
+        self.bot = bot
+        self.port = port
+        self.host = host
+        self.interval = interval
+        self.registry = registry
+        self._runner: web.AppRunner | None = None
+        self._sampler: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        """
+        Starts listening and sampling.
+        """
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._sampler = asyncio.create_task(self._sample(), name="metrics-sampler")
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self) -> None:
+        """
+        Stops listening and sampling.
+        """
+        if self._sampler is not None:
+            self._sampler.cancel()
+            self._sampler = None
+        if self._runner is not None:
+            runner, self._runner = self._runner, None
+            await runner.cleanup()
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.registry.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - self.interval))
+            GATEWAY_LATENCY.set(self.bot.latency)
@@ -0,0 +1,135 @@
+"""
+Bot-wide lookup of user and guild names, without a REST request per author.
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import Iterable
+
+import discord
+
+logger = logging.getLogger("discord_bot")
+
+
+class NameResolver:
+    def __init__(
+        self,
+        bot,
+        *,
+        ttl: float = 7 * 24 * 60 * 60,
+        concurrency: int = 4,
+        rate: float = 20.0,
+    ) -> None:
+        """
+        Resolves user IDs to names, trying memory, then the database, then the gateway cache and
+        only then the API.
+
+        Names found on the gateway or fetched from the API are written back to the database, so
+        they survive restarts. Every tier forgets a name after `ttl` seconds.
+
+        :param bot: The bot whose database, gateway cache and HTTP client are used.
+        :param ttl: The number of seconds a name is trusted for.
+        :param concurrency: The number of users fetched from the API at the same time.
+        :param rate: The maximum number of users fetched from the API per second.
+        """
+        self.bot = bot
+        self.ttl = ttl
+        self.rate = rate
+        self._memory: dict[int, tuple[float, str]] = {}
+        self._guilds: dict[int, str] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._next_request = 0.0
+        self._pending: dict[int, asyncio.Task] = {}
+
+    async def users(
+        self, user_ids: Iterable[int], guild: discord.Guild | None = None
+    ) -> dict[int, str]:
+        """
+        Looks up the names of many users at once.
+
+        :param user_ids: The IDs of the users, duplicates are looked up once.
+        :param guild: The guild the users were seen in, its member cache is tried first.
+        :return: A dictionary from user ID to name, with an entry for every ID.
+        """
+        now = time.time()
+        names = {}
+        missing = set()
+        for user_id in set(user_ids):
+            entry = self._memory.get(user_id)
+            if entry is not None and entry[0] >= now - self.ttl:
+                names[user_id] = entry[1]
+            else:
+                missing.add(user_id)
+        if not missing:
+            return names
+
+        stored = await self.bot.database.get_names(missing, since=int(now - self.ttl))
+        for user_id, name in stored.items():
+            self._memory[user_id] = (now, name)
+        names.update(stored)
+        missing.difference_update(stored)
+
+        found = {}
+        for user_id in missing:
+            user = (guild.get_member(user_id) if guild is not None else None) or self.bot.get_user(user_id)
+            if user is not None:
+                found[user_id] = user.name
+        missing.difference_update(found)
+
+        if missing:
+            fetched = await asyncio.gather(*(self._fetch(user_id) for user_id in missing))
+            found.update((user_id, name) for user_id, name in zip(missing, fetched) if name is not None)
+            for user_id, name in zip(missing, fetched):
+                names[user_id] = name if name is not None else str(user_id)
+
+        for user_id, name in found.items():
+            self._memory[user_id] = (now, name)
+        names.update(found)
+        await self.bot.database.set_names(found)
+        return names
+
+    async def user(self, user_id: int, guild: discord.Guild | None = None) -> str:
+        """
+        Looks up the name of a single user, see `users`.
+
+        :param user_id: The ID of the user.
+        :param guild: The guild the user was seen in.
+        """
+        return (await self.users((user_id,), guild))[user_id]
+
+    def guild(self, guild_id: int) -> str:
+        """
+        The name of a guild, the last known one if the bot has left it.
+
+        :param guild_id: The ID of the guild.
+        """
+        guild = self.bot.get_guild(guild_id)
+        if guild is not None:
+            self._guilds[guild_id] = guild.name
+        return self._guilds.get(guild_id, str(guild_id))
+
+    def _fetch(self, user_id: int) -> asyncio.Task:
+        # Lookups of the same user made at the same time share a single request.
+        task = self._pending.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._request(user_id))
+            self._pending[user_id] = task
+            task.add_done_callback(lambda _: self._pending.pop(user_id, None))
+        return task
+
+    async def _request(self, user_id: int) -> str | None:
+        async with self._semaphore:
+            now = time.monotonic()
+            delay = self._next_request - now
+            self._next_request = max(now, self._next_request) + 1 / self.rate
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except discord.NotFound:
+                return "Deleted User"
+            except discord.HTTPException as e:
+                logger.warning(f"Failed to fetch user {user_id}: {e}")
+                return None
+            return user.name
@@ -0,0 +1,124 @@
+"""
+A shared spaCy pipeline that runs in worker processes, so NLP work never blocks the event loop.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+from collections.abc import Sequence
+
+from database.terms import tokenize_all
+from helpers.workers import WorkerPool
+
+logger = logging.getLogger("discord_bot")
+
+# The pipeline of the current worker process, loaded once by `_load_pipeline`.
+_nlp = None
+
+
+def _load_pipeline(model: str) -> None:
+    global _nlp
+    import spacy
+
+    try:
+        # Word counting only needs the tokenizer, every trained component is excluded.
+        _nlp = spacy.load(
+            model,
+            exclude=["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "ner", "senter"],
+        )
+    except OSError:
+        # The model is not installed, the blank English pipeline has the same tokenizer.
+        _nlp = spacy.blank("en")
+
+
+def _stop_words() -> frozenset[str]:
+    from spacy.lang.en.stop_words import STOP_WORDS
+
+    return frozenset(STOP_WORDS)
+
+
+def _terms(texts: Sequence[str], batch_size: int) -> list[list[str]]:
+    return [
+        [token.lower_ for token in doc if token.is_alpha]
+        for doc in _nlp.pipe(texts, batch_size=batch_size)
+    ]
+
+
+class NLPService:
+    def __init__(
+        self,
+        model: str = "en_core_web_sm",
+        *,
+        processes: int | None = None,
+        batch_size: int = 256,
+    ) -> None:
+        """
+        Tokenizes messages with spaCy in a pool of worker processes.
+
+        Every worker loads the model once when it starts. When spaCy is not installed the
+        regex tokenizer from `database.terms` is used instead.
+
+        :param model: The spaCy model to load.
+        :param processes: The number of worker processes, defaults to the number of cores (up to 4).
+        :param batch_size: The number of messages sent to a worker at once.
+        """
+        self.model = model
+        self.processes = processes or min(4, os.cpu_count() or 1)
+        self.batch_size = batch_size
+        self._pool = WorkerPool(
+            "spaCy", self.processes, initializer=_load_pipeline, initargs=(model,)
+        )
+        self._stop_words: frozenset[str] | None = None
+
+    @property
+    def available(self) -> bool:
+        """
+        Whether spaCy is being used, `False` when the regex fallback is.
+        """
+        return self._pool.started
+
+    def start(self) -> None:
+        """
+        Creates the worker pool, each worker loads the model when the first calls start it.
+
+        spaCy itself is only imported by the workers, importing it here would cost the bot
+        seconds of startup time and hundreds of megabytes.
+        """
+        if importlib.util.find_spec("spacy") is None:
+            logger.warning("spaCy is not installed, falling back to the regex tokenizer")
+            return
+        self._pool.start()
+
+    async def stop_words(self) -> frozenset[str]:
+        """
+        spaCy's English stop words, loaded by a worker the first time they are needed.
+        """
+        if self._stop_words is None:
+            if not self.available:
+                return frozenset()
+            self._stop_words = await self._pool.run(_stop_words)
+        return self._stop_words
+
+    async def terms(self, texts: Sequence[str]) -> list[list[str]]:
+        """
+        Splits messages into their lowercase words, this is a `database.terms.Tokenizer`.
+
+        :param texts: The contents of the messages.
+        :return: The words of each message, in the same order.
+        """
+        if not self.available:
+            return await tokenize_all(texts)
+        batches = await asyncio.gather(
+            *(
+                self._pool.run(_terms, texts[i : i + self.batch_size], self.batch_size)
+                for i in range(0, len(texts), self.batch_size)
+            )
+        )
+        return [words for batch in batches for words in batch]
+
+    async def close(self) -> None:
+        """
+        Stops the worker processes.
+        """
+        await self._pool.close()
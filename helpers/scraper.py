@@ -0,0 +1,242 @@
+"""
+Incremental, checkpointed scraping of a guild's message history into the logs.
+"""
+
+import asyncio
+import logging
+
+import discord
+
+logger = logging.getLogger("discord_bot")
+
+BACKFILL_NONE = 0
+BACKFILL_PENDING = 1
+BACKFILL_DONE = 2
+
+
+class Scraper:
+    def __init__(
+        self,
+        bot,
+        *,
+        concurrency: int = 4,
+        backfill_concurrency: int = 2,
+        initial_limit: int = 1024,
+        checkpoint_every: int = 1000,
+    ) -> None:
+        """
+        Walks the text channels of a guild and feeds their messages into the bot's message buffer.
+
+        Every channel keeps a high-water mark (the newest logged message ID) so that reruns only
+        fetch what is new, and a low-water mark that the background backfill walks down from.
+
+        :param bot: The bot whose database and message buffer are used.
+        :param concurrency: The number of channels that are read at the same time by `!scrape`.
+        :param backfill_concurrency: The number of channels that are backfilled at the same time.
+            Backfills hold their slot for hours, so they have their own and never delay a scrape.
+        :param initial_limit: The number of recent messages read from a channel that was never scraped.
+        :param checkpoint_every: The number of messages between two checkpoints.
+        """
+        self.bot = bot
+        self.initial_limit = initial_limit
+        self.checkpoint_every = checkpoint_every
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._backfill_semaphore = asyncio.Semaphore(backfill_concurrency)
+        self._backfills: dict[int, asyncio.Task] = {}
+
+    @staticmethod
+    def readable_channels(guild: discord.Guild) -> list[discord.TextChannel]:
+        """
+        Lists the text channels of a guild whose history the bot is allowed to read.
+
+        :param guild: The guild whose channels should be listed.
+        """
+        channels = []
+        for channel in guild.text_channels:
+            permissions = channel.permissions_for(guild.me)
+            if permissions.view_channel and permissions.read_message_history:
+                channels.append(channel)
+        return channels
+
+    async def scrape_guild(self, guild: discord.Guild) -> int:
+        """
+        Fetches every message that is newer than the checkpoints of the guild's channels.
+
+        A channel that fails, because the bot lost access to it for instance, is logged and skipped.
+
+        :param guild: The guild that should be scraped.
+        :return: The number of messages that were read.
+        """
+        channels = self.readable_channels(guild)
+        counts = await asyncio.gather(
+            *(self.scrape_channel(channel) for channel in channels),
+            return_exceptions=True,
+        )
+        total = 0
+        for channel, count in zip(channels, counts):
+            if isinstance(count, BaseException):
+                logger.error(
+                    f"Failed to scrape #{channel} (ID: {channel.id})\n{type(count).__name__}: {count}"
+                )
+            else:
+                total += count
+        return total
+
+    async def scrape_channel(self, channel: discord.TextChannel) -> int:
+        """
+        Fetches the messages of a channel that are newer than its checkpoint.
+
+        :param channel: The channel that should be scraped.
+        :return: The number of messages that were read.
+        """
+        async with self._semaphore:
+            state = await self.bot.database.get_scrape_state(channel.id)
+            if state is None or state[0] is None:
+                return await self._scrape_recent(channel)
+
+            count = 0
+            last_message_id = state[0]
+            async for message in channel.history(
+                limit=None, after=discord.Object(id=last_message_id), oldest_first=True
+            ):
+                self._log(message)
+                last_message_id = message.id
+                count += 1
+                if count % self.checkpoint_every == 0:
+                    await self._checkpoint(channel, last_message_id=last_message_id)
+            if count:
+                await self._checkpoint(channel, last_message_id=last_message_id)
+            return count
+
+    async def _scrape_recent(self, channel: discord.TextChannel) -> int:
+        count = 0
+        newest_message_id = oldest_message_id = None
+        async for message in channel.history(limit=self.initial_limit):
+            self._log(message)
+            if newest_message_id is None:
+                newest_message_id = message.id
+            oldest_message_id = message.id
+            count += 1
+        await self._checkpoint(
+            channel,
+            last_message_id=newest_message_id,
+            oldest_message_id=oldest_message_id,
+        )
+        return count
+
+    def start_backfill(self, guild: discord.Guild) -> bool:
+        """
+        Starts reading the full history of a guild in the background.
+
+        :param guild: The guild that should be backfilled.
+        :return: Whether a new backfill was started, `False` if one is already running.
+        """
+        task = self._backfills.get(guild.id)
+        if task is not None and not task.done():
+            return False
+        self._backfills[guild.id] = asyncio.create_task(
+            self._backfill_guild(guild, self.readable_channels(guild)),
+            name=f"backfill-{guild.id}",
+        )
+        return True
+
+    async def resume_backfills(self) -> None:
+        """
+        Restarts the backfills that were still pending when the bot last stopped.
+        """
+        channels_by_guild: dict[int, list[discord.TextChannel]] = {}
+        for server_id, channel_id in await self.bot.database.get_pending_backfills():
+            channel = self.bot.get_channel(channel_id)
+            if isinstance(channel, discord.TextChannel):
+                channels_by_guild.setdefault(server_id, []).append(channel)
+        for server_id, channels in channels_by_guild.items():
+            if server_id not in self._backfills or self._backfills[server_id].done():
+                logger.info(f"Resuming backfill of {len(channels)} channel(s) in guild {server_id}")
+                self._backfills[server_id] = asyncio.create_task(
+                    self._backfill_guild(channels[0].guild, channels),
+                    name=f"backfill-{server_id}",
+                )
+
+    def is_backfilling(self, guild: discord.Guild) -> bool:
+        """
+        Checks whether a backfill of the guild is currently running.
+
+        :param guild: The guild that should be checked.
+        """
+        task = self._backfills.get(guild.id)
+        return task is not None and not task.done()
+
+    def cancel(self) -> None:
+        """
+        Cancels every running backfill, their checkpoints let them resume later.
+        """
+        for task in self._backfills.values():
+            task.cancel()
+        self._backfills.clear()
+
+    async def _backfill_guild(
+        self, guild: discord.Guild, channels: list[discord.TextChannel]
+    ) -> None:
+        for channel in channels:
+            state = await self.bot.database.get_scrape_state(channel.id)
+            if state is None or state[2] != BACKFILL_DONE:
+                await self._checkpoint(channel, backfill=BACKFILL_PENDING)
+        counts = await asyncio.gather(
+            *(self.backfill_channel(channel) for channel in channels),
+            return_exceptions=True,
+        )
+        total = 0
+        for channel, count in zip(channels, counts):
+            if isinstance(count, BaseException):
+                logger.error(
+                    f"Failed to backfill #{channel} (ID: {channel.id})\n{type(count).__name__}: {count}"
+                )
+            else:
+                total += count
+        logger.info(f"Backfilled {total} messages in {guild.name} (ID: {guild.id})")
+
+    async def backfill_channel(self, channel: discord.TextChannel) -> int:
+        """
+        Reads the history of a channel from its oldest logged message back to the very beginning.
+
+        :param channel: The channel that should be backfilled.
+        :return: The number of messages that were read.
+        """
+        async with self._backfill_semaphore:
+            state = await self.bot.database.get_scrape_state(channel.id)
+            if state is not None and state[2] == BACKFILL_DONE:
+                return 0
+            # A scrape may move the high-water mark while this runs, so it is only set when missing.
+            has_high_water_mark = state is not None and state[0] is not None
+            last_message_id = None
+            oldest_message_id = state[1] if state is not None else None
+            before = discord.Object(id=oldest_message_id) if oldest_message_id else None
+
+            count = 0
+            async for message in channel.history(limit=None, before=before):
+                self._log(message)
+                if last_message_id is None and not has_high_water_mark:
+                    last_message_id = message.id
+                oldest_message_id = message.id
+                count += 1
+                if count % self.checkpoint_every == 0:
+                    await self._checkpoint(
+                        channel,
+                        last_message_id=last_message_id,
+                        oldest_message_id=oldest_message_id,
+                    )
+            await self._checkpoint(
+                channel,
+                last_message_id=last_message_id,
+                oldest_message_id=oldest_message_id,
+                backfill=BACKFILL_DONE,
+            )
+            return count
+
+    def _log(self, message: discord.Message) -> None:
+        self.bot.message_buffer.put(message)
+
+    async def _checkpoint(self, channel: discord.TextChannel, **state) -> None:
+        # The rows have to be on disk before the checkpoint moves past them.
+        await self.bot.message_buffer.flush()
+        await self.bot.database.set_scrape_state(channel.id, channel.guild.id, **state)
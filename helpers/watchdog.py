@@ -0,0 +1,150 @@
+"""
+Detects callbacks that block the event loop and names the command they were running for.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+
+from helpers.metrics import EVENT_LOOP_STALLS
+
+logger = logging.getLogger("discord_bot")
+
+_COGS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "cogs")
+
+
+class Offender:
+    def __init__(self, name: str) -> None:
+        """
+        The stalls attributed to one command, or to one place in the code outside of commands.
+
+        :param name: The command, or the place in the code.
+        """
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.stack: list[str] = []
+
+
+class LoopWatchdog:
+    def __init__(
+        self, *, threshold: float = 0.25, interval: float = 0.1, top: int = 10
+    ) -> None:
+        """
+        Watches the event loop from a separate thread.
+
+        A task on the loop beats every `interval` seconds. When a beat is more than `threshold`
+        seconds late, the thread captures the stack of the loop thread, which is then still inside
+        the blocking call. Once the loop recovers the stall is logged with that stack and the
+        command whose task was running, and added to a table of the worst offenders.
+
+        :param threshold: The number of seconds the loop may be blocked before it is reported.
+        :param interval: The number of seconds between two beats.
+        :param top: The number of offenders that are remembered.
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+        self.offenders: dict[str, Offender] = {}
+        self._commands: weakref.WeakKeyDictionary[asyncio.Task, str] = weakref.WeakKeyDictionary()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._beat_at = 0.0
+        self._capture: tuple[float, str, list[str]] | None = None
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._beat: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """
+        Starts watching the running event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat_at = time.monotonic()
+        self._stopped.clear()
+        self._beat = asyncio.create_task(self._run_beat(), name="watchdog-beat")
+        self._thread = threading.Thread(target=self._watch, name="watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops watching.
+        """
+        self._stopped.set()
+        if self._beat is not None:
+            self._beat.cancel()
+            self._beat = None
+
+    def track(self, name: str) -> None:
+        """
+        Attributes the stalls of the current task to a command.
+
+        :param name: How the command should be reported, such as `analysis.frequency`.
+        """
+        task = asyncio.current_task()
+        if task is not None:
+            self._commands[task] = name
+
+    def worst(self) -> list[Offender]:
+        """
+        The remembered offenders, the one with the longest stall first.
+        """
+        return sorted(self.offenders.values(), key=lambda offender: offender.worst, reverse=True)
+
+    async def _run_beat(self) -> None:
+        while True:
+            beat_at = self._beat_at = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - beat_at - self.interval
+            capture, self._capture = self._capture, None
+            if capture is not None and capture[0] == beat_at and lag >= self.threshold:
+                self._record(lag, capture[1], capture[2])
+
+    def _watch(self) -> None:
+        # Polling at half the beat interval keeps the cost to a few dozen wake-ups per second.
+        while not self._stopped.wait(self.interval / 2):
+            beat_at = self._beat_at
+            if self._capture is not None and self._capture[0] == beat_at:
+                continue
+            if time.monotonic() - beat_at < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            self._capture = (beat_at, self._offender(stack), traceback.format_list(stack[-12:]))
+
+    def _offender(self, stack: traceback.StackSummary) -> str:
+        task = asyncio.current_task(self._loop)
+        if task is not None and task in self._commands:
+            return self._commands[task]
+        # Outside of a tracked task, the innermost frame in a cog still names the culprit.
+        for frame in reversed(stack):
+            if frame.filename.startswith(_COGS_PATH):
+                module = os.path.splitext(os.path.basename(frame.filename))[0]
+                return f"{module}.{frame.name}"
+        return f"{os.path.basename(stack[-1].filename)}:{stack[-1].name}" if stack else "unknown"
+
+    def _record(self, lag: float, name: str, stack: list[str]) -> None:
+        EVENT_LOOP_STALLS.inc(offender=name)
+        logger.warning(
+            f"The event loop was blocked for {lag * 1000:.0f}ms by {name}\n" + "".join(stack).rstrip()
+        )
+        offender = self.offenders.get(name)
+        if offender is None:
+            offender = self.offenders[name] = Offender(name)
+        offender.count += 1
+        offender.total += lag
+        if lag >= offender.worst:
+            offender.worst = lag
+            offender.stack = stack
+        if len(self.offenders) > self.top:
+            del self.offenders[min(self.offenders.values(), key=lambda o: o.worst).name]
@@ -0,0 +1,126 @@
+"""
+The bot's HTTP client for external APIs, one pooled session with retries and a response cache.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any
+
+import aiohttp
+
+logger = logging.getLogger("discord_bot")
+
+# Worth retrying, everything else in the 4xx range will fail the same way again.
+_RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class WebClient:
+    def __init__(
+        self,
+        *,
+        limit: int = 64,
+        limit_per_host: int = 8,
+        timeout: float = 10.0,
+        retries: int = 2,
+        backoff: float = 0.5,
+        rewrites: dict[str, str] | None = None,
+    ) -> None:
+        """
+        Sends the requests of every cog through a single connection pool, so connections, DNS
+        lookups and TLS sessions are reused between commands.
+
+        :param limit: The maximum number of open connections.
+        :param limit_per_host: The maximum number of open connections to a single host.
+        :param timeout: The number of seconds a single attempt may take.
+        :param retries: The number of times a failed request is retried.
+        :param backoff: The delay before the first retry, in seconds, it doubles with every retry.
+        :param rewrites: URL prefixes to replace, used to point the bot at a local stub server.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rewrites = rewrites or {}
+        self.hits = 0
+        self.misses = 0
+        self._session: aiohttp.ClientSession | None = None
+        self._cache: dict[str, tuple[float, Any]] = {}
+        self._pending: dict[str, asyncio.Task] = {}
+
+    def start(self) -> None:
+        """
+        Opens the session, this has to happen while the event loop is running.
+        """
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=300
+            ),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def close(self) -> None:
+        """
+        Closes the session and every pooled connection.
+        """
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    async def get_json(self, url: str, *, ttl: float = 0) -> Any:
+        """
+        Fetches a JSON document.
+
+        Responses are kept for `ttl` seconds, and requests for the same URL made while one is in
+        flight wait for it instead of sending their own.
+
+        :param url: The URL of the document.
+        :param ttl: The number of seconds the response may be reused for, `0` to always fetch.
+        :return: The decoded document.
+        :raises aiohttp.ClientError: The request failed, even after retrying.
+        :raises asyncio.TimeoutError: The request timed out, even after retrying.
+        """
+        if ttl <= 0:
+            return await self._get_json(url)
+
+        entry = self._cache.get(url)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        task = self._pending.get(url)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._get_json(url, ttl=ttl))
+            self._pending[url] = task
+            task.add_done_callback(lambda _: self._pending.pop(url, None))
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    async def _get_json(self, url: str, *, ttl: float = 0) -> Any:
+        key = url
+        for prefix, replacement in self.rewrites.items():
+            if url.startswith(prefix):
+                url = replacement + url[len(prefix) :]
+                break
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._session.get(url) as response:
+                    if response.status in _RETRY_STATUSES and attempt < self.retries:
+                        logger.warning(f"GET {url} returned {response.status}, retrying")
+                    else:
+                        response.raise_for_status()
+                        # Some APIs serve JSON with a JavaScript or text content type.
+                        data = await response.json(content_type=None)
+                        if ttl > 0:
+                            self._cache[key] = (time.monotonic() + ttl, data)
+                        return data
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"GET {url} failed ({type(e).__name__}), retrying")
+            await asyncio.sleep(self.backoff * 2**attempt * random.uniform(0.5, 1.5))
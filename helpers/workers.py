@@ -0,0 +1,94 @@
+"""
+Pools of worker processes that replace themselves when a worker dies.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger("discord_bot")
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        name: str,
+        processes: int,
+        *,
+        initializer: Callable | None = None,
+        initargs: tuple = (),
+    ) -> None:
+        """
+        Runs functions in a pool of worker processes, off the event loop.
+
+        The workers are started by a fork server, a single-threaded process that imports `bot.py`
+        once, without running the bot, and forks a worker whenever one is needed. Forking the bot
+        itself is not safe once the database, export and watchdog threads are running, a worker
+        could inherit a lock held by one of them and hang. Workers are started on demand, so an
+        idle pool costs nothing but the fork server.
+
+        :param name: What the workers are for, used in the logs.
+        :param processes: The number of worker processes.
+        :param initializer: Called by every worker when it starts.
+        :param initargs: The arguments of `initializer`.
+        """
+        self.name = name
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self._pool: ProcessPoolExecutor | None = None
+
+    @property
+    def started(self) -> bool:
+        """
+        Whether `start` was called and `close` was not.
+        """
+        return self._pool is not None
+
+    def start(self) -> None:
+        """
+        Creates the pool, its workers are started by the first calls.
+        """
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=self.initializer,
+            initargs=self.initargs,
+        )
+
+    async def run(self, function: Callable, *args):
+        """
+        Calls a function in one of the workers.
+
+        A worker that dies, killed by the OOM killer for instance, breaks the whole pool and every
+        call after it would fail. The pool is then replaced by a new one and the call is tried once
+        more, a second failure is raised.
+
+        :param function: The function to call, it must be defined at the top level of a module.
+        :param args: The arguments of the function, they must be picklable.
+        :return: What the function returned.
+        """
+        pool = self._pool
+        if pool is None:
+            raise RuntimeError(f"The {self.name} workers are not running")
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(pool, function, *args)
+        except BrokenProcessPool:
+            # Concurrent calls fail together, only the first one replaces the pool.
+            if self._pool is pool:
+                logger.warning(f"A {self.name} worker died, restarting the worker processes")
+                pool.shutdown(wait=False, cancel_futures=True)
+                self.start()
+            return await loop.run_in_executor(self._pool, function, *args)
+
+    async def close(self) -> None:
+        """
+        Stops the worker processes.
+        """
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from cogs.llm import LLMScheduler
+
+
+def test_cancelled_waiter_is_not_handed_a_slot():
+    async def scenario():
+        scheduler = LLMScheduler(concurrency=1)
+        job = scheduler.job(1)
+        gate = asyncio.Event()
+
+        async def blocked():
+            await gate.wait()
+            return "a"
+
+        async def instant(result):
+            return result
+
+        a = asyncio.create_task(scheduler.run(job, "a", blocked))
+        await asyncio.sleep(0)
+        b = asyncio.create_task(scheduler.run(job, "b", lambda: instant("b")))
+        c = asyncio.create_task(scheduler.run(job, "c", lambda: instant("c")))
+        for _ in range(2):
+            await asyncio.sleep(0)
+        assert scheduler.depth == 2
+
+        # B's waiter is cancelled before its task runs, and A releases its slot in between.
+        gate.set()
+        scheduler._in_flight["b"].cancel()
+
+        assert await a == "a"
+        with pytest.raises(asyncio.CancelledError):
+            await b
+        assert await asyncio.wait_for(c, 1) == "c"
+        assert scheduler._running == 0
+        assert scheduler.depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_one_caller_does_not_cancel_a_shared_call():
+    async def scenario():
+        scheduler = LLMScheduler(concurrency=1)
+        gate = asyncio.Event()
+        calls = 0
+
+        async def generate():
+            nonlocal calls
+            calls += 1
+            await gate.wait()
+            return "shared"
+
+        a = asyncio.create_task(scheduler.run(scheduler.job(1), "key", generate))
+        b = asyncio.create_task(scheduler.run(scheduler.job(2), "key", generate))
+        await asyncio.sleep(0)
+        a.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await a
+        assert await b == "shared"
+        assert calls == 1
+        assert scheduler.deduplicated == 1
+
+        # Once its last caller is gone the call itself is cancelled and forgotten.
+        gate.clear()
+        c = asyncio.create_task(scheduler.run(scheduler.job(1), "other", generate))
+        await asyncio.sleep(0)
+        c.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await c
+        await asyncio.sleep(0)
+        assert scheduler._in_flight == {} and scheduler._running == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,30 @@
+import asyncio
+
+from database.buffer import MessageBuffer
+
+
+class SlowDatabase:
+    def __init__(self) -> None:
+        self.written = []
+        self.writing = asyncio.Event()
+
+    async def write_batch(self, batch):
+        self.writing.set()
+        await asyncio.sleep(0.05)
+        self.written.extend(batch)
+        return len(batch)
+
+
+def test_close_waits_for_the_batch_being_written():
+    async def scenario():
+        database = SlowDatabase()
+        buffer = MessageBuffer(database, max_size=2, interval=60)
+        buffer.start()
+        buffer.put_delete(1)
+        buffer.put_delete(2)
+        await database.writing.wait()
+        buffer.put_delete(3)
+        await buffer.close()
+        assert [parameters for _, parameters in database.written] == [(1,), (2,), (3,)]
+
+    asyncio.run(scenario())
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import sqlite3
+
+import aiosqlite
+
+from database import DatabaseManager
+from database.migrations import latest_version, migrate
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "database", "schema.sql")
+
+
+def create_v1_database(path: str) -> None:
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        """
+        CREATE TABLE `logs` (
+          `user_id` varchar(20) NOT NULL,
+          `server_id` varchar(20) NOT NULL,
+          `message` text NOT NULL,
+          `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          UNIQUE (`user_id`, `server_id`, `message`, `created_at`)
+        );
+        INSERT INTO `logs` VALUES ('10', '1', 'lol', '2024-01-01 10:00:00');
+        INSERT INTO `logs` VALUES ('10', '1', 'lol', '2024-01-02 10:00:00');
+        INSERT INTO `logs` VALUES ('10', '1', 'lol', '2024-01-03 10:00:00');
+        INSERT INTO `logs` VALUES ('10', '1', 'hello there', '2024-01-03 11:00:00');
+        """
+    )
+    connection.commit()
+    connection.close()
+
+
+async def open_database(path: str) -> DatabaseManager:
+    # The same steps as `DiscordBot.init_db`.
+    connection = await aiosqlite.connect(path)
+    assert await migrate(connection) == latest_version()
+    with open(SCHEMA_PATH) as file:
+        await connection.executescript(file.read())
+    await connection.commit()
+    return DatabaseManager(connection=connection)
+
+
+async def fetch(database: DatabaseManager, query: str) -> list:
+    async with database.connection.execute(query) as cursor:
+        return await cursor.fetchall()
+
+
+def test_scraped_message_replaces_one_legacy_row(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "database.db")
+        create_v1_database(path)
+        database = await open_database(path)
+        try:
+            assert await fetch(database, "SELECT COUNT(*) FROM logs WHERE message_id < 0") == [(4,)]
+
+            # 2024-01-03 12:00 UTC, the real copy of one of the legacy messages and a new one.
+            await database.add_msgs(
+                [
+                    (1001, 5, 1, 10, "lol", 1704283200),
+                    (1002, 5, 1, 10, "new", 1704283201),
+                ]
+            )
+            rows = await fetch(database, "SELECT message FROM logs ORDER BY message_id")
+            assert sorted(rows) == [("hello there",), ("lol",), ("lol",), ("lol",), ("new",)]
+            assert await fetch(
+                database, "SELECT COUNT(*) FROM logs WHERE message_id < 0 AND message = 'lol'"
+            ) == [(2,)]
+            assert await fetch(database, "SELECT SUM(count) FROM message_counts") == [(5,)]
+        finally:
+            await database.connection.close()
+
+    asyncio.run(scenario())
+
+
+def test_edit_with_the_same_text_changes_nothing(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "database.db")
+        create_v1_database(path)
+        database = await open_database(path)
+        try:
+            await database.add_msgs([(1001, 5, 1, 10, "look at this", 1704283200)])
+            await database.write_batch([("edit", ("look at this", 1001))])
+            assert await fetch(database, "SELECT SUM(version) FROM summary_dirty WHERE channel_id = 5") == [(2,)]
+            assert await fetch(database, "SELECT COUNT(*) FROM term_queue WHERE channel_id = 5") == [(1,)]
+
+            await database.write_batch([("edit", ("look at that", 1001))])
+            assert await fetch(database, "SELECT SUM(version) FROM summary_dirty WHERE channel_id = 5") == [(4,)]
+            assert await fetch(database, "SELECT COUNT(*) FROM term_queue WHERE channel_id = 5") == [(3,)]
+        finally:
+            await database.connection.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,34 @@
+import asyncio
+import os
+import signal
+
+import pytest
+
+from helpers.workers import WorkerPool
+
+
+def test_pool_is_replaced_when_a_worker_dies():
+    async def scenario():
+        pool = WorkerPool("test", 1)
+        pool.start()
+        try:
+            pid = await pool.run(os.getpid)
+            os.kill(pid, signal.SIGKILL)
+            # The first call after the death finds the pool broken and is retried on a new one.
+            assert await pool.run(os.getpid) != pid
+            assert await pool.run(sum, [1, 2]) == 3
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_closed_pool_refuses_calls():
+    async def scenario():
+        pool = WorkerPool("test", 1)
+        pool.start()
+        await pool.close()
+        with pytest.raises(RuntimeError):
+            await pool.run(os.getpid)
+
+    asyncio.run(scenario())